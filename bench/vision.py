@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Benchmark of marker detection, replaying recorded YUYV frames
+
+The frames are raw YUYV frames, all at the same resolution, either one
+after another in a file, one per file in a directory, or a ring file
+recorded on the robot by Robot.record_vision().  They are
+replayed with sr.replay.ReplayVision, and so go through the same
+conversion and detection code that Vision.see() uses on a live camera.
+No webcam is needed.  For example:
+
+% PYTHONPATH=pyenv/pylib python bench/vision.py -r 800x600 -l pyenv/lib frames.yuyv
+"""
+import optparse, os
+from sr import vision, replay, timing
+
+def find_libkoki():
+    "Find the directory containing libkoki.so"
+    for d in os.environ.get( "LD_LIBRARY_PATH", "" ).split(":"):
+        if d and os.path.exists( os.path.join( d, "libkoki.so" ) ):
+            return os.path.abspath(d)
+
+    return "."
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser( usage = "%prog [options] FRAMES" )
+    parser.add_option( "-r", "--res", default="800x600",
+                       help="Resolution of the recorded frames, as WxH" )
+    parser.add_option( "-n", "--frames", type="int", default=200,
+                       help="Number of frames to process" )
+    parser.add_option( "-m", "--mode", default="dev",
+                       help="The marker mode: 'dev' or 'comp'" )
+    parser.add_option( "-c", "--camera", default="c500",
+                       help="Camera the frames were recorded with: 'c500' or 'c270'" )
+    parser.add_option( "-l", "--lib", default=None,
+                       help="Directory containing libkoki.so" )
+    parser.add_option( "-z", "--zero-copy", action="store_true", default=False,
+                       help="Reuse grayscale images between frames" )
+    opts, args = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error( "A frames file or directory is required" )
+
+    res = tuple( int(x) for x in opts.res.split("x") )
+    focal = { "c500": vision.C500_focal_length,
+              "c270": vision.C270_focal_length }[ opts.camera ]
+    lib = opts.lib if opts.lib is not None else find_libkoki()
+
+    v = replay.ReplayVision( args[0], res, lib, focal_length = focal,
+                             zero_copy = opts.zero_copy )
+
+    nmarkers = 0
+    allocs = 0
+    v.profile = timing.Profile( vision.PROFILE_STAGES, size = opts.frames )
+    start = timing.monotonic()
+
+    for n in range(opts.frames):
+        markers, times = v.see( mode = opts.mode, res = res, stats = True )
+        nmarkers += len(markers)
+        allocs += times["allocs"]
+
+    duration = timing.monotonic() - start
+
+    print "%i frames (%i recorded) at %ix%i in %.2fs: %.2f frames/sec" % \
+        ( opts.frames, v.nframes, res[0], res[1], duration, opts.frames / duration )
+    print "%.2f markers per frame" % ( float(nmarkers) / opts.frames )
+    print "%.2f image allocations per frame" % \
+        ( float(allocs) / opts.frames )
+    print
+
+    print "%-14s %10s %10s %10s" % ( "stage (ms)", "p50", "p95", "p99" )
+    for k in [ "cam", "yuyv", "find_markers", "convert" ]:
+        s = v.profile[k].summary()
+        print "%-14s %10.2f %10.2f %10.2f" % ( k, s["p50"] * 1000,
+                                               s["p95"] * 1000,
+                                               s["p99"] * 1000 )
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""Micro-benchmark of the marker width callback that libkoki calls
+
+libkoki calls the width callback once for every candidate marker that
+it finds.  This compares the cost per candidate of building a new
+callback for each frame (as Vision.see() used to) with using the cached
+per-mode callback."""
+import functools, optparse, timeit
+import pykoki
+from sr import vision
+
+def width_from_code(lut, code):
+    if code not in lut:
+        return 0.1
+
+    return lut[code].size
+
+def bench_per_frame(mode, codes):
+    "Build a callback for the frame, then call it for each candidate"
+    f = pykoki.WIDTH_FROM_CODE_FUNC( functools.partial( width_from_code,
+                                                        vision.marker_luts[mode] ) )
+    for c in codes:
+        f(c)
+
+def bench_cached(func, codes):
+    "Call the cached callback for each candidate"
+    for c in codes:
+        func(c)
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option( "-c", "--candidates", type="int", default=50,
+                       help="Number of candidate markers per frame" )
+    parser.add_option( "-f", "--frames", type="int", default=2000,
+                       help="Number of frames to run" )
+    parser.add_option( "-m", "--mode", default="dev",
+                       help="The marker mode: 'dev' or 'comp'" )
+    opts, args = parser.parse_args()
+
+    # A mix of known and unknown codes
+    codes = [ (n * 37) % 256 for n in range(opts.candidates) ]
+    func = pykoki.WIDTH_FROM_CODE_FUNC( vision.marker_widths[opts.mode].__getitem__ )
+
+    n = opts.frames * opts.candidates
+    before = timeit.timeit( lambda: bench_per_frame( opts.mode, codes ),
+                            number = opts.frames )
+    after = timeit.timeit( lambda: bench_cached( func, codes ),
+                           number = opts.frames )
+
+    print "Per-frame callback: %.2f us per candidate" % (before * 1e6 / n)
+    print "Cached callback:    %.2f us per candidate" % (after * 1e6 / n)
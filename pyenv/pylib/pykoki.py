@@ -136,6 +136,30 @@ class Buffer(Structure):
         return "Buffer (length=%s, start = %s)" % (self.length, self.start)
 
 
+class IplImage(Structure):
+    # Only the header is described here -- the pixel data is owned by
+    # whoever created the image (OpenCV, via libkoki)
+    _fields_ = [("nSize", c_int), ("ID", c_int), ("nChannels", c_int),
+                ("alphaChannel", c_int), ("depth", c_int),
+                ("colorModel", c_char * 4), ("channelSeq", c_char * 4),
+                ("dataOrder", c_int), ("origin", c_int), ("align", c_int),
+                ("width", c_int), ("height", c_int),
+                ("roi", c_void_p), ("maskROI", c_void_p),
+                ("imageId", c_void_p), ("tileInfo", c_void_p),
+                ("imageSize", c_int), ("imageData", c_void_p),
+                ("widthStep", c_int), ("BorderMode", c_int * 4),
+                ("BorderConst", c_int * 4), ("imageDataOrigin", c_void_p)]
+
+    def __repr__(self):
+        return "IplImage (width=%d, height=%d, nChannels=%d, widthStep=%d)" % (self.width, self.height, self.nChannels, self.widthStep)
+
+
+class CvSize(Structure):
+    _fields_ = [("width", c_int), ("height", c_int)]
+
+
+IPL_DEPTH_8U = 8
+
 WIDTH_FROM_CODE_FUNC = CFUNCTYPE(c_float, c_int)
 
 
@@ -234,6 +258,32 @@ class PyKoki:
         l.koki_crc12.argtypes = [c_uint8]
         l.koki_crc12.restype = c_uint16
 
+        ### OpenCV, which libkoki is linked against ###
+
+        # Used to pull the Y plane out of a YUYV frame straight into an
+        # existing image.  Without these, images are converted by libkoki.
+        try:
+            # IplImage* cvInitImageHeader(IplImage* image, CvSize size,
+            #                             int depth, int channels,
+            #                             int origin, int align)
+            l.cvInitImageHeader.argtypes = [POINTER(IplImage), CvSize,
+                                            c_int, c_int, c_int, c_int]
+            l.cvInitImageHeader.restype = c_void_p
+
+            # void cvSetData(CvArr* arr, void* data, int step)
+            l.cvSetData.argtypes = [POINTER(IplImage), c_void_p, c_int]
+            l.cvSetData.restype = None
+
+            # void cvSplit(const CvArr* src, CvArr* dst0, CvArr* dst1,
+            #              CvArr* dst2, CvArr* dst3)
+            l.cvSplit.argtypes = [POINTER(IplImage), c_void_p,
+                                  c_void_p, c_void_p, c_void_p]
+            l.cvSplit.restype = None
+
+            self.convert_into_native = True
+        except AttributeError:
+            self.convert_into_native = False
+
 
     def _make_copy(self, o):
         ret = type(o)()
@@ -279,9 +329,81 @@ class PyKoki:
     def v4l_YUYV_frame_to_grayscale_image(self, frame, w, h):
         return self.libkoki.koki_v4l_YUYV_frame_to_grayscale_image(frame, w, h)
 
+    def v4l_YUYV_frame_to_grayscale_into(self, frame, w, h, img):
+        """Convert a YUYV frame into an existing grayscale image
+
+        The grayscale image is the Y plane of the frame, which OpenCV
+        copies out in place by viewing the frame as a 2-channel image.
+        If OpenCV can't be used (convert_into_native is False), libkoki
+        converts the frame into a temporary image, which is copied."""
+        if self.convert_into_native:
+            src = IplImage()
+            self.libkoki.cvInitImageHeader(src, CvSize(w, h), IPL_DEPTH_8U, 2, 0, 4)
+            self.libkoki.cvSetData(src, frame, w * 2)
+            self.libkoki.cvSplit(src, img, None, None, None)
+            return img
+
+        tmp = self.libkoki.koki_v4l_YUYV_frame_to_grayscale_image(frame, w, h)
+        src = self._image_header(tmp)
+        dest = self._image_header(img)
+        assert dest.width == w and dest.height == h
+
+        for row in range(h):
+            memmove(dest.imageData + row * dest.widthStep,
+                    src.imageData + row * src.widthStep, w)
+
+        self.image_free(tmp)
+        return img
+
+    def v4l_frame_buffer(self, frame, length):
+        "Return a ctypes array that views (not copies) the given frame"
+        return cast(frame, POINTER(c_uint8 * length)).contents
+
+    def image_alloc(self, w, h):
+        "Allocate a grayscale image, to be freed with image_free()"
+        # libkoki doesn't expose an allocator, so convert a blank frame
+        blank = (c_uint8 * (w * h * 2))()
+        return self.libkoki.koki_v4l_YUYV_frame_to_grayscale_image(blank, w, h)
+
     def image_free(self, img):
         self.libkoki.koki_image_free(img)
 
+    def _image_header(self, img):
+        return cast(img, POINTER(IplImage)).contents
+
+    def _image_fill(self, img, data, w, h):
+        "Fill a w x h grayscale image with tightly packed pixel data"
+        hdr = self._image_header(img)
+        assert hdr.width == w and hdr.height == h
+
+        if hdr.widthStep == w:
+            memmove(hdr.imageData, data, w * h)
+        else:
+            for row in range(h):
+                memmove(hdr.imageData + row * hdr.widthStep,
+                        data[row * w:(row + 1) * w], w)
+
+    def image_crop_into(self, img, x, y, w, h, dest):
+        "Copy the w x h region at (x,y) of a grayscale image into dest"
+        src = self._image_header(img)
+        assert x + w <= src.width and y + h <= src.height
+
+        rows = [string_at(src.imageData + (y + row) * src.widthStep + x, w)
+                for row in range(h)]
+        self._image_fill(dest, "".join(rows), w, h)
+        return dest
+
+    def image_downscale_into(self, img, factor, dest):
+        "Subsample a grayscale image by a whole number factor into dest"
+        src = self._image_header(img)
+        w, h, step = src.width, src.height, src.widthStep
+
+        data = string_at(src.imageData, step * h)
+        rows = [data[row * step:row * step + w:factor]
+                for row in range(0, h, factor)]
+        self._image_fill(dest, "".join(rows), w // factor, h // factor)
+        return dest
+
     def find_markers(self, image, marker_width, params):
         markers = self.libkoki.koki_find_markers(image, marker_width, params)
 
@@ -299,7 +421,12 @@ class PyKoki:
         return ret
 
     def find_markers_fp(self, image, func, params):
-        markers = self.libkoki.koki_find_markers_fp(image, WIDTH_FROM_CODE_FUNC(func), params)
+        # Callers can pass an already-wrapped callback to save creating
+        # a new ctypes thunk on every call
+        if not isinstance(func, WIDTH_FROM_CODE_FUNC):
+            func = WIDTH_FROM_CODE_FUNC(func)
+
+        markers = self.libkoki.koki_find_markers_fp(image, func, params)
 
         ret = []
 
@@ -314,5 +441,42 @@ class PyKoki:
 
         return ret
 
+    def _copy_markers_array(self, markers, accept = None):
+        """Copy the markers in a GPtrArray into one contiguous Marker array
+        If accept is given, only markers whose code indexes a true value
+        in it are copied."""
+        n = markers.contents.len.value
+        pdata = markers.contents.pdata
+
+        ptrs = [ pdata[i] for i in range(n) ]
+        if accept is not None:
+            # The code is the first byte of each marker
+            ptrs = [ p for p in ptrs if accept[ ord( string_at(p, 1) ) ] ]
+
+        ret = (Marker * len(ptrs))()
+        base = addressof(ret)
+        size = sizeof(Marker)
+
+        for i, p in enumerate(ptrs):
+            memmove(base + i * size, p, size)
+
+        return ret
+
+    def find_markers_fp_array(self, image, func, params, accept = None):
+        """Find markers, returning them in a ctypes Marker array
+
+        This makes one copy of the markers into a single block of
+        memory, rather than a separate ctypes object per marker.
+        Markers can be filtered by code with accept (see
+        _copy_markers_array) before they're copied."""
+        if not isinstance(func, WIDTH_FROM_CODE_FUNC):
+            func = WIDTH_FROM_CODE_FUNC(func)
+
+        markers = self.libkoki.koki_find_markers_fp(image, func, params)
+        ret = self._copy_markers_array(markers, accept)
+        self.libkoki.koki_markers_free(markers)
+
+        return ret
+
     def crc12(self, n):
         return self.libkoki.koki_crc12(n)
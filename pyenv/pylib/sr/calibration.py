@@ -0,0 +1,156 @@
+"Camera calibrations, and the versioned file that they're stored in"
+import json, logging, os
+from pykoki import CameraParams, Point2Df, Point2Di
+
+logger = logging.getLogger( "sr.calibration" )
+
+# Version of the calibration file format
+CALIBRATION_VERSION = 1
+
+# Where calibrations are stored, unless SR_CAMERA_CALIBRATION says
+# otherwise -- in pyenv's var directory, so they persist across boots
+CALIBRATION_FILE = os.path.normpath(
+    os.path.join( os.path.dirname( os.path.abspath( __file__ ) ),
+                  "..", "..", "var", "camera-calibration.json" ) )
+
+# How close two aspect ratios have to be to count as the same
+ASPECT_TOLERANCE = 0.01
+
+def usb_id_key(usb_id):
+    "The key for a camera's (vendor, product) USB IDs in the calibration file"
+    return "%04x:%04x" % tuple(usb_id)
+
+def _res_key(res):
+    return "%ix%i" % tuple(res)
+
+def _parse_res(key):
+    return tuple( int(x) for x in key.split("x") )
+
+class CameraCalibration(object):
+    """The focal lengths of a camera at each of its resolutions
+
+    Indexing with a resolution gives the (x, y) focal length in pixels.
+    The focal length for a resolution that wasn't calibrated is
+    interpolated from the calibrated ones with the same aspect ratio."""
+    def __init__(self, focal_lengths, name = None):
+        self.name = name
+        self.focal_lengths = dict( ( tuple(res), tuple(fl) )
+                                   for res, fl in focal_lengths.iteritems() )
+
+        # Interpolated focal lengths, and CameraParams, by resolution
+        self._interpolated = {}
+        self._params = {}
+
+    def keys(self):
+        "The calibrated resolutions"
+        return self.focal_lengths.keys()
+
+    def __iter__(self):
+        return iter( self.focal_lengths )
+
+    def __len__(self):
+        return len( self.focal_lengths )
+
+    def __contains__(self, res):
+        return tuple(res) in self.focal_lengths
+
+    def __getitem__(self, res):
+        res = tuple(res)
+        if res in self.focal_lengths:
+            return self.focal_lengths[res]
+
+        if res not in self._interpolated:
+            self._interpolated[res] = self._interpolate(res)
+
+        return self._interpolated[res]
+
+    def _interpolate(self, res):
+        """Interpolate the focal length for an uncalibrated resolution
+
+        Focal length in pixels is roughly proportional to the width of
+        the image, so the ratio of the two is interpolated by width."""
+        aspect = float(res[0]) / res[1]
+
+        # (width, fx/width, fy/width) for each calibrated resolution
+        known = [ ( r[0], fl[0] / r[0], fl[1] / r[0] )
+                  for r, fl in self.focal_lengths.iteritems() ]
+        same = [ k for k, r in zip( known, self.focal_lengths )
+                 if abs( float(r[0]) / r[1] - aspect ) < ASPECT_TOLERANCE ]
+        if len(same):
+            known = same
+
+        if len(known) == 0:
+            raise KeyError(res)
+
+        known.sort()
+        below = [ k for k in known if k[0] <= res[0] ]
+        above = [ k for k in known if k[0] >= res[0] ]
+        lo = below[-1] if len(below) else above[0]
+        hi = above[0] if len(above) else below[-1]
+
+        t = 0.0
+        if hi[0] != lo[0]:
+            t = float( res[0] - lo[0] ) / ( hi[0] - lo[0] )
+
+        return ( ( lo[1] + t * ( hi[1] - lo[1] ) ) * res[0],
+                 ( lo[2] + t * ( hi[2] - lo[2] ) ) * res[0] )
+
+    def params(self, res):
+        "The CameraParams for whole frames at the given resolution"
+        res = tuple(res)
+        if res not in self._params:
+            fx, fy = self[res]
+            self._params[res] = CameraParams( Point2Df( res[0]/2, res[1]/2 ),
+                                              Point2Df( fx, fy ),
+                                              Point2Di( *res ) )
+
+        return self._params[res]
+
+    def to_json(self):
+        return { "name": self.name,
+                 "focal_length": dict( ( _res_key(res), list(fl) )
+                                       for res, fl in self.focal_lengths.iteritems() ) }
+
+    @classmethod
+    def from_json(cls, d):
+        return cls( dict( ( _parse_res(res), fl )
+                          for res, fl in d["focal_length"].iteritems() ),
+                    name = d.get("name") )
+
+def calibration_path():
+    return os.environ.get( "SR_CAMERA_CALIBRATION", CALIBRATION_FILE )
+
+def load(path = None):
+    """Load the calibrations in the calibration file
+    Returns a dict of CameraCalibrations, indexed by usb_id_key()."""
+    if path is None:
+        path = calibration_path()
+
+    try:
+        with open( path, "r" ) as f:
+            data = json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+    if data.get( "version" ) != CALIBRATION_VERSION:
+        logger.warning( "Ignoring calibration file %s of unsupported version %s",
+                        path, data.get( "version" ) )
+        return {}
+
+    return dict( ( key, CameraCalibration.from_json(d) )
+                 for key, d in data["cameras"].iteritems() )
+
+def save(calibrations, path = None):
+    "Write a dict of CameraCalibrations, as from load(), to the calibration file"
+    if path is None:
+        path = calibration_path()
+
+    data = { "version": CALIBRATION_VERSION,
+             "cameras": dict( ( key, cal.to_json() )
+                              for key, cal in calibrations.iteritems() ) }
+
+    # Write it atomically, as several processes may be reading it
+    tmp = "%s.%i" % ( path, os.getpid() )
+    with open( tmp, "w" ) as f:
+        json.dump( data, f, indent = 1, sort_keys = True )
+    os.rename( tmp, path )
@@ -0,0 +1,159 @@
+"""Colour blob detection on YUYV frames
+
+This doesn't need numpy (which isn't on the robot).  Thresholding is
+done a whole channel at a time with str.translate() and long integer
+arithmetic, and the cells' counts a row of cells at a time by adding
+rows of the mask together as packed integers."""
+import binascii
+from collections import namedtuple
+
+# A range of colours in YUV space
+# Each field is an inclusive (min, max) range of 0-255 values
+ColourRange = namedtuple( "ColourRange", "y u v" )
+
+RED = ColourRange( y = (30, 255), u = (0, 128), v = (165, 255) )
+GREEN = ColourRange( y = (30, 255), u = (0, 120), v = (0, 120) )
+BLUE = ColourRange( y = (30, 255), u = (150, 255), v = (0, 128) )
+YELLOW = ColourRange( y = (100, 255), u = (0, 100), v = (128, 180) )
+
+# A blob of colour
+# Fields:
+#  - colour: The name of the colour that the blob matched
+#  - centre: The centroid of the blob, as an (x, y) tuple.  This is the
+#            mean of its cells' centres, weighted by their matching pixels.
+#  - area: The number of pixels in the blob
+#  - bounds: (left, top, right, bottom) of the grid cells the blob is in
+Blob = namedtuple( "Blob", "colour centre area bounds" )
+
+# The size of the grid cells that blobs are made of, in pixels
+BLOCK_SIZE = 8
+
+# The fraction of a cell's pixels that must match for it to be in a blob
+CELL_FILL = 0.5
+
+def _label(cells):
+    """Find the 4-connected groups of the given set of (row, col) cells
+    Returns a list of lists of cells."""
+    cells = set(cells)
+    groups = []
+
+    while len(cells):
+        todo = [ cells.pop() ]
+        group = []
+
+        while len(todo):
+            r, c = todo.pop()
+            group.append( (r, c) )
+
+            for n in ( (r-1, c), (r+1, c), (r, c-1), (r, c+1) ):
+                if n in cells:
+                    cells.remove(n)
+                    todo.append(n)
+
+        groups.append(group)
+
+    return groups
+
+def _range_table(r):
+    "A str.translate() table mapping values in the range r to 1, others to 0"
+    return "".join( "\x01" if r[0] <= i <= r[1] else "\x00"
+                    for i in range(256) )
+
+def _pack(s):
+    "A string of bytes as a long integer, the first byte most significant"
+    return int( binascii.hexlify(s), 16 )
+
+def _unpack(n, length):
+    "The inverse of _pack(), giving length bytes"
+    return binascii.unhexlify( ( "%x" % n ).zfill( length * 2 ) )
+
+def _and(strs):
+    """Byte-wise AND of equal-length strings of 0 and 1 bytes
+    The strings are treated as long integers, so this isn't a Python loop."""
+    n = -1
+    for s in strs:
+        n &= _pack(s)
+
+    return _unpack( n, len(strs[0]) )
+
+def _cell_counts(mask, mw, top, block, bw):
+    """Count the set bytes in each cell of a row of cells of a mask
+    mask is a string of 0 and 1 bytes, mw bytes wide.  The cells are
+    block rows high, starting at row top, and bw bytes wide.  Each cell's
+    count must be less than 256.  Returns a bytearray of the counts."""
+    # Add the rows up, so that each byte holds its column's count
+    cols = 0
+    for y in range( top, top + block ):
+        cols += _pack( mask[ y * mw : ( y + 1 ) * mw ] )
+
+    # Add each byte to the next bw-1, so that the last byte of each
+    # cell holds the cell's count
+    cells = cols
+    for i in range( 1, bw ):
+        cells += cols >> ( 8 * i )
+
+    return bytearray( _unpack( cells, mw )[ bw - 1 :: bw ] )
+
+def find_blobs(frame, res, colours, block = BLOCK_SIZE, min_area = 0):
+    """Find blobs of colour in a YUYV frame
+
+    frame is a buffer containing the frame (e.g. from
+    Vision.frame_buffer(), or a str).  colours is a dict of ColourRanges,
+    indexed by name.  A macropixel matches if both its Y values, and its
+    U and V, are in range.  Returns a dict of lists of Blobs, indexed by
+    colour name, with the largest blobs first.  block * block/2 must be
+    less than 256."""
+    w, h = res
+    data = buffer( frame )[ : w * h * 2 ]
+
+    # Each macropixel is Y0 U Y1 V, and covers two pixels
+    mw = w // 2
+    chans = [ data[i::4] for i in range(4) ]
+
+    # Grid of cells, each block x block pixels (block/2 macropixels wide)
+    bw = max( 1, block // 2 )
+    rows = h // block
+    cols = mw // bw
+    full_count = CELL_FILL * block * bw
+    if block * bw > 255:
+        raise ValueError( "Blocks of %i pixels are too big to count" % block )
+
+    blobs = {}
+    for name, cr in colours.iteritems():
+        tables = [ _range_table(r) for r in ( cr.y, cr.u, cr.y, cr.v ) ]
+        mask = _and( [ c.translate(t) for c, t in zip( chans, tables ) ] )
+
+        count = {}
+        for r in range(rows):
+            counts = _cell_counts( mask, mw, r * block, block, bw )
+
+            for c in range(cols):
+                if counts[c] >= full_count:
+                    count[ (r, c) ] = counts[c]
+
+        found = []
+        for group in _label( count.keys() ):
+            n = sum( count[cell] for cell in group )
+            # Each macropixel is two pixels
+            area = n * 2
+            if area < min_area:
+                continue
+
+            gr = [ cell[0] for cell in group ]
+            gc = [ cell[1] for cell in group ]
+            # Cell (r, c) is centred on pixel ( c + 0.5, r + 0.5 ) * block - 0.5
+            mid = ( block - 1 ) / 2.0
+            centre = ( sum( count[cell] * cell[1] for cell in group ) * block / float(n) + mid,
+                       sum( count[cell] * cell[0] for cell in group ) * block / float(n) + mid )
+
+            found.append( Blob( colour = name,
+                                centre = ( float(centre[0]), float(centre[1]) ),
+                                area = area,
+                                bounds = ( min(gc) * block, min(gr) * block,
+                                           ( max(gc) + 1 ) * block,
+                                           ( max(gr) + 1 ) * block ) ) )
+
+        found.sort( key = lambda b: b.area, reverse = True )
+        blobs[name] = found
+
+    return blobs
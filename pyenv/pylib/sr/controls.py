@@ -0,0 +1,221 @@
+"Control of a camera's exposure, gain and frame rate through V4L2"
+import errno, fcntl
+from collections import namedtuple
+from v4l2 import v4l2
+
+# The V4L2 controls that can be set, by name
+CONTROL_IDS = {
+    # V4L2_EXPOSURE_MANUAL or V4L2_EXPOSURE_APERTURE_PRIORITY (auto)
+    "exposure_auto": v4l2.V4L2_CID_EXPOSURE_AUTO,
+    # Exposure time, in units of 100us
+    "exposure": v4l2.V4L2_CID_EXPOSURE_ABSOLUTE,
+    # Whether auto exposure may lower the frame rate
+    "exposure_auto_priority": v4l2.V4L2_CID_EXPOSURE_AUTO_PRIORITY,
+    "gain": v4l2.V4L2_CID_GAIN,
+}
+
+# Frame interval, as a (numerator, denominator) fraction of a second.
+# This is set through VIDIOC_S_PARM rather than as a control.
+FRAME_INTERVAL = "frame_interval"
+
+# Controls are set in this order, so that exposure can only be set
+# once auto exposure has been turned off
+CONTROL_ORDER = [ "exposure_auto", "exposure_auto_priority",
+                  "exposure", "gain", FRAME_INTERVAL ]
+
+# Presets of control settings.  Those that a camera doesn't support
+# are skipped, and values are clipped to each camera's range.  Controls
+# that a preset doesn't name are returned to their defaults.
+PRESETS = {
+    # What the camera does by itself
+    "auto": { "exposure_auto": v4l2.V4L2_EXPOSURE_APERTURE_PRIORITY,
+              "exposure_auto_priority": 1 },
+
+    # A short, fixed exposure, so that markers aren't blurred when
+    # moving, at a steady 30 fps.  Gain makes up for the lost light.
+    "fast": { "exposure_auto": v4l2.V4L2_EXPOSURE_MANUAL,
+              "exposure_auto_priority": 0,
+              "exposure": 50,
+              "gain": 192,
+              FRAME_INTERVAL: (1, 30) },
+
+    # Longer exposure for dim arenas, still without dropping frames
+    "dim": { "exposure_auto": v4l2.V4L2_EXPOSURE_MANUAL,
+             "exposure_auto_priority": 0,
+             "exposure": 250,
+             "gain": 255,
+             FRAME_INTERVAL: (1, 30) },
+}
+
+ControlInfo = namedtuple( "ControlInfo", "name minimum maximum step default" )
+
+class CameraControls(object):
+    """The controls of a Vision's camera
+
+    Controls are read and set by name (see CONTROL_IDS and
+    FRAME_INTERVAL), e.g. controls["exposure"] = 50.  Settings are
+    remembered and applied again whenever the camera is reopened."""
+    def __init__(self, vision):
+        self._vision = vision
+
+        # The settings made, by name
+        self.settings = {}
+
+        # The frame interval before it was first changed, as there's
+        # no default to query
+        self._default_interval = None
+
+    def _ioctl(self, request, arg):
+        fcntl.ioctl( self._vision.fd, request, arg )
+
+    def _query(self, name):
+        q = v4l2.v4l2_queryctrl()
+        q.id = CONTROL_IDS[name]
+
+        try:
+            self._ioctl( v4l2.VIDIOC_QUERYCTRL, q )
+        except IOError, e:
+            if e.errno == errno.EINVAL:
+                "The camera doesn't have this control"
+                return None
+            raise
+
+        if q.flags & v4l2.V4L2_CTRL_FLAG_DISABLED:
+            return None
+
+        return ControlInfo( name = q.name,
+                            minimum = q.minimum,
+                            maximum = q.maximum,
+                            step = q.step,
+                            default = q.default )
+
+    def _get_parm(self):
+        parm = v4l2.v4l2_streamparm()
+        parm.type = v4l2.V4L2_BUF_TYPE_VIDEO_CAPTURE
+        self._ioctl( v4l2.VIDIOC_G_PARM, parm )
+        return parm
+
+    def _has_frame_interval(self):
+        try:
+            parm = self._get_parm()
+        except IOError:
+            return False
+
+        return bool( parm.parm.capture.capability & v4l2.V4L2_CAP_TIMEPERFRAME )
+
+    def _get(self, name):
+        if name == FRAME_INTERVAL:
+            tpf = self._get_parm().parm.capture.timeperframe
+            return ( tpf.numerator, tpf.denominator )
+
+        c = v4l2.v4l2_control()
+        c.id = CONTROL_IDS[name]
+        self._ioctl( v4l2.VIDIOC_G_CTRL, c )
+        return c.value
+
+    def _set(self, name, value):
+        "Set a control, with the vision's lock held"
+        if name == FRAME_INTERVAL:
+            if self._default_interval is None:
+                self._default_interval = self._get( FRAME_INTERVAL )
+
+            parm = self._get_parm()
+            parm.parm.capture.timeperframe.numerator = value[0]
+            parm.parm.capture.timeperframe.denominator = value[1]
+
+            # Drivers refuse to change this whilst streaming
+            v = self._vision
+            was_streaming = v._streaming
+            if was_streaming:
+                v._stop()
+
+            self._ioctl( v4l2.VIDIOC_S_PARM, parm )
+
+            if was_streaming:
+                v._start()
+            return
+
+        info = self._query(name)
+        if info is not None:
+            value = max( info.minimum, min( info.maximum, value ) )
+
+        c = v4l2.v4l2_control()
+        c.id = CONTROL_IDS[name]
+        c.value = value
+        self._ioctl( v4l2.VIDIOC_S_CTRL, c )
+
+    def _apply(self):
+        "Apply the settings again, with the vision's lock held"
+        for name in CONTROL_ORDER:
+            if name in self.settings:
+                self._set( name, self.settings[name] )
+
+    def names(self):
+        "The names of the controls the camera supports"
+        with self._vision.lock:
+            names = [ n for n in CONTROL_ORDER
+                      if n != FRAME_INTERVAL and self._query(n) is not None ]
+
+            if self._has_frame_interval():
+                names.append( FRAME_INTERVAL )
+
+        return names
+
+    def query(self, name):
+        "The ControlInfo of a control, or None if the camera doesn't have it"
+        with self._vision.lock:
+            return self._query(name)
+
+    def __getitem__(self, name):
+        if name != FRAME_INTERVAL and name not in CONTROL_IDS:
+            raise KeyError(name)
+
+        with self._vision.lock:
+            return self._get(name)
+
+    def __setitem__(self, name, value):
+        if name != FRAME_INTERVAL and name not in CONTROL_IDS:
+            raise KeyError(name)
+
+        with self._vision.lock:
+            self._set( name, value )
+            self.settings[name] = value
+
+    def apply_preset(self, preset):
+        """Apply one of the PRESETS, skipping controls the camera doesn't have
+        This replaces any settings made before: the controls the preset
+        doesn't name go back to their defaults."""
+        settings = PRESETS[preset]
+
+        with self._vision.lock:
+            self.settings = {}
+
+            for name in CONTROL_ORDER:
+                if name == FRAME_INTERVAL:
+                    if not self._has_frame_interval():
+                        continue
+                    default = self._default_interval
+                else:
+                    info = self._query(name)
+                    if info is None:
+                        continue
+                    default = info.default
+
+                if name in settings:
+                    self._set( name, settings[name] )
+                    self.settings[name] = settings[name]
+                    continue
+
+                if default is None:
+                    "The frame interval has never been changed"
+                    continue
+
+                if name == FRAME_INTERVAL and self._get(name) == default:
+                    "Don't restart the stream for nothing"
+                    continue
+
+                try:
+                    self._set( name, default )
+                except IOError:
+                    # e.g. exposure can't be set whilst it's automatic
+                    pass
@@ -1,5 +1,7 @@
-import os
+import json, os, tempfile, threading, time
 from ctypes import *
+import timing
+from timing import monotonic
 
 # Magic device addresses
 SRIC_MASTER_DEVICE = 0
@@ -60,6 +62,163 @@ sric_errors = [ None,           # SRIC_ERROR_NONE
                 SricErrorTimeout,
                 SricErrorBroadcast ]
 
+class SricErrorNoNotes(Exception):
+    "libsric doesn't support notifications"
+    pass
+
+# How long, in ms, to wait for a reply by default (forever)
+DEFAULT_TIMEOUT = -1
+
+class RetryPolicy(object):
+    """How long to wait for replies, and how to retry when none comes
+
+    timeout is in ms (-1 waits forever).  A frame whose reply times out
+    is sent again up to retries times, waiting backoff seconds before the
+    first retry, and factor times longer before each one after that.
+    Only use retries with commands that are safe to repeat (the device
+    may have acted on an attempt whose reply was lost)."""
+    def __init__(self, timeout = DEFAULT_TIMEOUT, retries = 0,
+                 backoff = 0.005, factor = 2.0):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.factor = factor
+
+    def delay(self, attempt):
+        "The time to wait before retry number attempt (from 0)"
+        return self.backoff * self.factor ** attempt
+
+class AddressStats(object):
+    "Transaction statistics of one address"
+    def __init__(self):
+        self.transactions = 0
+        self.retries = 0
+        self.timeouts = 0
+        # Seconds from sending to receiving the reply, including retries
+        self.latency = timing.RollingStats()
+
+    def summary(self):
+        lat = self.latency.summary()
+        return { "transactions": self.transactions,
+                 "retries": self.retries,
+                 "timeouts": self.timeouts,
+                 "p50": lat.get( "p50" ),
+                 "p99": lat.get( "p99" ) }
+
+class SricStats(object):
+    "Transaction statistics of each address, which contexts can share"
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.addresses = {}
+
+    def __getitem__(self, address):
+        with self.lock:
+            if address not in self.addresses:
+                self.addresses[address] = AddressStats()
+
+            return self.addresses[address]
+
+    def record(self, address, latency, retries, timed_out):
+        st = self[address]
+
+        with self.lock:
+            st.transactions += 1
+            st.retries += retries
+            if timed_out:
+                st.timeouts += 1
+
+        if not timed_out:
+            st.latency.add( latency )
+
+    def summary(self):
+        "A dict of the statistics of each address"
+        with self.lock:
+            addresses = dict( self.addresses )
+
+        return dict( ( a, st.summary() ) for a, st in addresses.iteritems() )
+
+# Snapshot of the devices on the bus, shared between processes, and the
+# file sricd writes its pid to (see sricd.py)
+ENUM_CACHE_FILE = "/tmp/sric-enum.json"
+ENUM_CACHE_VERSION = 1
+SRICD_PID_FILE = "/tmp/sricd.pid"
+
+def enum_cache_path():
+    return os.environ.get( "PYSRIC_ENUM_CACHE", ENUM_CACHE_FILE )
+
+def _sricd_id():
+    """Identify the running sricd as [pid, start time], or None if there isn't one
+    The start time tells it apart from a later process with the same pid."""
+    try:
+        with open( SRICD_PID_FILE ) as f:
+            pid = int( f.read() )
+
+        with open( "/proc/%i/stat" % pid ) as f:
+            stat = f.read()
+    except (IOError, OSError, ValueError):
+        return None
+
+    # Fields after the command name (which may contain spaces),
+    # starting from the third -- the start time is the 22nd
+    fields = stat[ stat.rindex(")") + 2 : ].split()
+    return [ pid, int( fields[19] ) ]
+
+def load_enum_cache(path = None):
+    """Return the cached list of (address, type) of the devices on the bus
+    Returns None if there isn't a cache made by the running sricd."""
+    if path is None:
+        path = enum_cache_path()
+
+    sricd = _sricd_id()
+    if sricd is None:
+        return None
+
+    try:
+        with open( path ) as f:
+            cache = json.load( f )
+    except (IOError, OSError, ValueError):
+        return None
+
+    if not isinstance( cache, dict ) \
+            or cache.get( "version" ) != ENUM_CACHE_VERSION \
+            or cache.get( "sricd" ) != sricd:
+        "Out of date"
+        return None
+
+    return [ ( int(a), int(t) ) for a, t in cache["devices"] ]
+
+def save_enum_cache(devices, path = None):
+    """Cache a list of (address, type) of the devices on the bus
+    Failing to write the cache isn't fatal: it's just left as it was."""
+    if path is None:
+        path = enum_cache_path()
+
+    sricd = _sricd_id()
+    if sricd is None:
+        "Nothing to validate it against"
+        return
+
+    data = { "version": ENUM_CACHE_VERSION,
+             "sricd": sricd,
+             "devices": devices }
+
+    # Write it atomically, as other processes may be reading it
+    tmp = None
+    try:
+        fd, tmp = tempfile.mkstemp( dir = os.path.dirname( os.path.abspath(path) ),
+                                    prefix = os.path.basename(path) )
+        with os.fdopen( fd, "w" ) as f:
+            json.dump( data, f )
+        os.chmod( tmp, 0644 )
+        os.rename( tmp, path )
+    except (IOError, OSError):
+        "The cache only saves time, so carry on without it"
+        if tmp is not None:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
 class SricDevice(Structure):
     _fields_ = [("address", c_int), ("type", c_int)]
 
@@ -71,10 +230,19 @@ class SricDevice(Structure):
 
         return "SricDevice( address=%i, type=%s )" % (self.address, t)
 
-    def txrx(self, data, timeout = -1):
+    def txrx(self, data, timeout = None):
         "Transmit the given data"
         return self.pysric.txrx( self.address, data, timeout )
 
+    def txrx_into(self, data, buf, timeout = None):
+        "Transmit the given data, putting the reply in the bytearray buf"
+        return self.pysric.txrx_into( self.address, data, buf, timeout )
+
+    def txrx_many(self, datas, timeout = None):
+        "Transmit each of a list of payloads, returning the list of replies"
+        return self.pysric.txrx_many( [ (self.address, d) for d in datas ],
+                                      timeout )
+
 class SricFrame(Structure):
     _fields_ = [("address", c_int), ("note", c_int),
             ("payload_length", c_int),
@@ -88,24 +256,70 @@ class SricFrame(Structure):
         return "SricFrame( addr=%i, %s )" % (self.address, d)
 
 class PySric(object):
-    def __init__(self):
+    """A connection to sricd
+
+    policy is the RetryPolicy for transactions, and stats the SricStats
+    to record them in (both may be shared with other contexts).  Unless
+    use_cache is False, the devices come from the enumeration cache
+    written when sricd started, if it's still valid, rather than from
+    enumerating the bus again."""
+    def __init__(self, policy = None, stats = None, use_cache = True):
+        if policy is None:
+            policy = RetryPolicy()
+        if stats is None:
+            stats = SricStats()
+
+        self.policy = policy
+        self.stats = stats
+
         self._load_lib()
         self.sric_ctx = self.libsric.sric_init()
 
+        # Frames reused for every transaction on this context
+        self._txframe = SricFrame()
+        self._txframe.note = -1
+        self._rxframe = SricFrame()
+        self._noteframe = SricFrame()
+
         # Indexes are device classes
         self.devices = {}
+
+        cached = None
+        if use_cache:
+            cached = load_enum_cache()
+
+        if cached is not None:
+            for address, devtype in cached:
+                self._add_device( SricDevice( address, devtype ) )
+        else:
+            self._enumerate()
+
+            if use_cache:
+                "sricd must have been restarted since the cache was made"
+                self.write_enum_cache()
+
+    def _add_device(self, dev):
+        if dev.type not in self.devices:
+            self.devices[dev.type] = []
+
+        dev.pysric = self
+        self.devices[dev.type].append(dev)
+
+    def _enumerate(self):
+        "Find the devices on the bus"
         tmpdev = None
         while True:
             tmpdev = self.libsric.sric_enumerate_devices(self.sric_ctx, tmpdev)
             if cast(tmpdev, c_void_p).value == None:
                 break
 
-            dev = tmpdev[0]
-            if dev.type not in self.devices:
-                self.devices[dev.type] = []
+            self._add_device( tmpdev[0] )
 
-            dev.pysric = self
-            self.devices[dev.type].append(dev)
+    def write_enum_cache(self):
+        "Save the devices found in the enumeration cache, for other contexts"
+        save_enum_cache( [ ( dev.address, dev.type )
+                           for devs in self.devices.values()
+                           for dev in devs ] )
 
     def _load_lib(self):
         "Load the library and set up how to use it"
@@ -155,33 +369,208 @@ class PySric(object):
         libsric.sric_get_error.argtypes = [c_void_p]
         libsric.sric_get_error.restype = c_int
 
+        # Older libsrics don't have notification support
+        try:
+            # int sric_note_set_flags( sric_context ctx, int device,
+            #                          uint64_t flags )
+            libsric.sric_note_set_flags.argtypes = [c_void_p, c_int, c_uint64]
+            libsric.sric_note_set_flags.restype = c_int
+
+            # uint64_t sric_note_get_flags( sric_context ctx, int device )
+            libsric.sric_note_get_flags.argtypes = [c_void_p, c_int]
+            libsric.sric_note_get_flags.restype = c_uint64
+
+            # int sric_poll_note( sric_context ctx,
+            #                     sric_frame* frame,
+            #                     int timeout )
+            libsric.sric_poll_note.argtypes = [c_void_p, POINTER(SricFrame), c_int]
+            libsric.sric_poll_note.restype = c_int
+
+            self.has_notes = True
+        except AttributeError:
+            self.has_notes = False
+
         self.libsric = libsric
 
     def __del__(self):
         self.libsric.sric_quit(self.sric_ctx)
 
-    def txrx(self, address, data, timeout=-1):
-        txframe = SricFrame()
-        txframe.address = address
-        # This should always be -1
-        txframe.note = -1
+    def _reset(self):
+        """Replace the connection to sricd with a new one
+        Used after a timeout, so that the late reply (which would be
+        taken as that of the next transaction) goes with the old one.
+        Any notification registrations are lost too."""
+        self.libsric.sric_quit(self.sric_ctx)
+        self.sric_ctx = self.libsric.sric_init()
+
+    def _error(self):
+        "The exception for the context's last error"
+        return sric_errors[ self.libsric.sric_get_error(self.sric_ctx) ]
 
-        assert len(data) < 64
-        txframe.payload_length = len(data)
+    def _tx(self, address, data):
+        """Send a frame
+        data is a list of ints, or a str or bytearray."""
+        txframe = self._txframe
+        txframe.address = address
 
-        for i in range(0, len(data)):
-            "Fill the data in"
-            txframe.payload[i] = c_ubyte(data[i])
+        n = len(data)
+        assert n < 64
+        txframe.payload_length = n
 
-        rxframe = SricFrame()
+        # Fill the data in, in one go
+        if isinstance( data, bytearray ):
+            memmove( txframe.payload, (c_char * n).from_buffer(data), n )
+        elif isinstance( data, str ):
+            memmove( txframe.payload, data, n )
+        else:
+            txframe.payload[:n] = data
 
         r = self.libsric.sric_tx(self.sric_ctx, txframe)
         if r:
-            raise sric_errors[ self.libsric.sric_get_error(self.sric_ctx) ]
+            raise self._error()
+
+    def _rx(self, timeout):
+        """Wait up to timeout ms for a reply, returning its frame
+        The frame is reused by the next transaction."""
+        rxframe = self._rxframe
+
+        r = self.libsric.sric_poll_rx(self.sric_ctx, rxframe, timeout)
+        if r:
+            raise self._error()
+
+        return rxframe
+
+    def _transact(self, address, data, timeout):
+        """Send data and wait for the reply, retrying as the policy says
+        Raises SricErrorTimeout if there's still no reply after that.
+        The context is reset after each timeout (see _reset)."""
+        policy = self.policy
+        if timeout is None:
+            timeout = policy.timeout
+
+        start = monotonic()
+        retries = 0
 
-        r = self.libsric.sric_poll_rx(self.sric_ctx, rxframe, -1)
+        while True:
+            self._tx( address, data )
+
+            try:
+                rxframe = self._rx( timeout )
+                break
+            except SricErrorTimeout:
+                self._reset()
+
+                if retries >= policy.retries:
+                    self.stats.record( address, monotonic() - start, retries, True )
+                    raise
+
+            time.sleep( policy.delay( retries ) )
+            retries += 1
+
+        self.stats.record( address, monotonic() - start, retries, False )
+        return rxframe
+
+    def txrx(self, address, data, timeout=None):
+        """Transmit data to address, and return the reply's payload
+        timeout is in ms, overriding that of the policy."""
+        rxframe = self._transact( address, data, timeout )
+        return rxframe.payload[:rxframe.payload_length]
+
+    def txrx_into(self, address, data, buf, timeout=None):
+        """Transmit data, copying the reply's payload into buf
+        buf is a bytearray.  Returns a memoryview of the reply in buf."""
+        rxframe = self._transact( address, data, timeout )
+
+        n = rxframe.payload_length
+        if n > len(buf):
+            raise ValueError( "Reply of %i bytes doesn't fit in buffer" % n )
+
+        memmove( (c_char * n).from_buffer(buf), rxframe.payload, n )
+        return memoryview(buf)[:n]
+
+    def _check_notes(self):
+        if not self.has_notes:
+            raise SricErrorNoNotes()
+
+    def note_set_flags(self, address, flags):
+        """Choose the notifications to receive from the device at address
+        flags is a bitmask, with bit n set to receive note n."""
+        self._check_notes()
+        if self.libsric.sric_note_set_flags(self.sric_ctx, address, flags):
+            raise self._error()
+
+    def note_get_flags(self, address):
+        "The bitmask of the notifications received from the device at address"
+        self._check_notes()
+        return self.libsric.sric_note_get_flags(self.sric_ctx, address)
+
+    def poll_note(self, timeout=-1):
+        """Wait up to timeout ms (forever if -1) for a registered notification
+        Returns an (address, note, payload) tuple, or None on timeout."""
+        self._check_notes()
+        frame = self._noteframe
+
+        r = self.libsric.sric_poll_note(self.sric_ctx, frame, timeout)
         if r:
-            raise sric_errors[ self.libsric.sric_get_error(self.sric_ctx) ]
+            err = self._error()
+            if err is SricErrorTimeout:
+                return None
+            raise err
+
+        return ( frame.address, frame.note,
+                 frame.payload[:frame.payload_length] )
+
+    def txrx_many(self, transactions, timeout=None):
+        """Perform several transactions, sending them all before any reply
+        transactions is a list of (address, data) pairs, which may be for
+        different devices.  sricd queues the frames, so only one round
+        trip is waited for rather than one per transaction.  Returns the
+        list of the replies' payloads, in the order of transactions.
+        These transactions aren't retried on timeout, but the context is
+        reset (see _reset)."""
+        if timeout is None:
+            timeout = self.policy.timeout
+        start = monotonic()
+
+        # Indices of the transactions sent, by address
+        sent = {}
+        nsent = 0
+        error = None
+
+        for n, (address, data) in enumerate(transactions):
+            try:
+                self._tx( address, data )
+            except Exception, e:
+                "Collect the replies already on their way first"
+                error = e
+                break
+
+            sent.setdefault( address, [] ).append(n)
+            nsent += 1
+
+        replies = [None] * nsent
+        for r in range(nsent):
+            try:
+                rxframe = self._rx( timeout )
+            except SricErrorTimeout:
+                self._reset()
+
+                for address, ns in sent.iteritems():
+                    for n in ns:
+                        self.stats.record( address, 0, 0, True )
+                raise
+
+            self.stats.record( rxframe.address, monotonic() - start, 0, False )
+
+            # Replies come from the device transacted with
+            if rxframe.address in sent and len( sent[rxframe.address] ):
+                n = sent[rxframe.address].pop(0)
+            else:
+                n = replies.index(None)
+
+            replies[n] = rxframe.payload[:rxframe.payload_length]
+
+        if error is not None:
+            raise error
 
-        resp = [int(rxframe.payload[i]) for i in range(0,rxframe.payload_length)]
-        return resp
+        return replies
@@ -0,0 +1,210 @@
+"""Recording of raw camera frames into a memory-mapped ring file
+
+A ring file is a RingHeader followed by a fixed number of slots, each
+a SlotHeader and one raw YUYV frame.  Once all the slots have been
+used, the oldest frame is overwritten, so the file never grows.  The
+frames can be replayed with replay.ReplayVision.
+
+Frames are copied into the file by a FrameWriter thread, so that the
+copy isn't made whilst the camera is locked."""
+import mmap, threading
+from ctypes import Structure, addressof, c_char, c_double, c_uint8, \
+    c_uint32, c_uint64, memmove, sizeof
+
+RING_MAGIC = "SRFR"
+RING_VERSION = 1
+
+class RingHeader(Structure):
+    _fields_ = [ ("magic", c_char * 4),
+                 ("version", c_uint32),
+                 ("width", c_uint32),
+                 ("height", c_uint32),
+                 ("slots", c_uint32),
+                 # Frames recorded in total, including overwritten ones
+                 ("count", c_uint64) ]
+
+class SlotHeader(Structure):
+    _fields_ = [ ("timestamp", c_double),
+                 ("seq", c_uint64) ]
+
+def frame_size(res):
+    "The size, in bytes, of a raw YUYV frame"
+    return res[0] * res[1] * 2
+
+def slot_size(res):
+    return sizeof(SlotHeader) + frame_size(res)
+
+def ring_size(res, slots):
+    "The size, in bytes, of a ring file"
+    return sizeof(RingHeader) + slots * slot_size(res)
+
+def is_ring_file(fname):
+    "Whether the given file is a ring file"
+    f = open( fname, "rb" )
+    magic = f.read( len(RING_MAGIC) )
+    f.close()
+    return magic == RING_MAGIC
+
+class RingFile(object):
+    """A ring file mapped into memory
+
+    mapping is a writable mmap of the file (which may be ACCESS_COPY
+    for reading)."""
+    def __init__(self, mapping):
+        self._map = mapping
+        self._data = (c_uint8 * len(mapping)).from_buffer(mapping)
+        self.header = RingHeader.from_buffer(mapping)
+
+    def _init_header(self, res, slots):
+        h = self.header
+        h.magic = RING_MAGIC
+        h.version = RING_VERSION
+        h.width, h.height = res
+        h.slots = slots
+        h.count = 0
+
+    def check(self):
+        "Raise ValueError if the header isn't that of a usable ring file"
+        h = self.header
+        if h.magic != RING_MAGIC or h.version != RING_VERSION:
+            raise ValueError( "Not a version %i frame ring file" % RING_VERSION )
+
+        if len(self._map) < ring_size( self.res, h.slots ):
+            raise ValueError( "Frame ring file is truncated" )
+
+    @property
+    def res(self):
+        return ( int(self.header.width), int(self.header.height) )
+
+    @property
+    def nframes(self):
+        "The number of frames held in the file"
+        return min( self.header.count, self.header.slots )
+
+    def _slot_address(self, seq):
+        "The address of the slot of the seq'th frame recorded"
+        n = seq % self.header.slots
+        return addressof(self._data) + sizeof(RingHeader) + n * slot_size(self.res)
+
+    def _nth_seq(self, n):
+        "The sequence number of the n'th oldest frame in the file"
+        return self.header.count - self.nframes + n
+
+    def frame_address(self, n):
+        "The address of the n'th oldest frame in the file"
+        return self._slot_address( self._nth_seq(n) ) + sizeof(SlotHeader)
+
+    def timestamp(self, n):
+        "The capture timestamp of the n'th oldest frame in the file"
+        slot = SlotHeader.from_address( self._slot_address( self._nth_seq(n) ) )
+        return slot.timestamp
+
+class FrameRecorder(RingFile):
+    """Records raw frames into a new ring file of the given number of slots
+
+    The file is preallocated, so that recording doesn't use any more
+    disk space as it goes.  Each frame is copied straight from the
+    camera's buffer into the mapped file; the kernel writes it out.
+    Recording is normally done through a FrameWriter."""
+    def __init__(self, fname, res, slots):
+        f = open( fname, "w+b" )
+        f.truncate( ring_size( res, slots ) )
+        m = mmap.mmap( f.fileno(), 0 )
+        f.close()
+
+        RingFile.__init__( self, m )
+        self._init_header( res, slots )
+        self._frame_size = frame_size(res)
+
+    def record(self, frame, timestamp):
+        "Copy a raw frame (a pointer to its buffer) into the next slot"
+        h = self.header
+        addr = self._slot_address( h.count )
+
+        memmove( addr + sizeof(SlotHeader), frame, self._frame_size )
+
+        slot = SlotHeader.from_address( addr )
+        slot.timestamp = timestamp
+        slot.seq = h.count
+
+        # Only counted once it's all there
+        h.count += 1
+
+    def flush(self):
+        self._map.flush()
+
+class FrameWriter(threading.Thread):
+    """Thread that copies frames into a FrameRecorder
+
+    Only the newest frame offered is kept: if the thread is still busy
+    when more arrive, the ones in between aren't recorded."""
+    def __init__(self, recorder):
+        threading.Thread.__init__(self)
+
+        # Allow things to quit even if this thread persists
+        self.daemon = True
+
+        self.recorder = recorder
+        self.running = True
+        self.dropped = 0
+        self.cond = threading.Condition()
+
+        # (frame pointer, timestamp) of the frame waiting to be copied
+        self._pending = None
+
+        # Whether a frame is being copied
+        self._copying = False
+
+    @property
+    def res(self):
+        return self.recorder.res
+
+    def offer(self, frame, timestamp):
+        "Hand over a raw frame (a pointer to its buffer) to be recorded"
+        with self.cond:
+            if self._pending is not None:
+                self.dropped += 1
+
+            self._pending = ( frame, timestamp )
+            self.cond.notify_all()
+
+    def sync(self):
+        """Finish with the frame last offered, before its buffer is reused
+        A copy that's under way is waited for; one that hasn't started
+        yet is dropped."""
+        with self.cond:
+            if self._pending is not None:
+                self._pending = None
+                self.dropped += 1
+
+            while self._copying:
+                self.cond.wait()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self._pending is None and self.running:
+                    self.cond.wait()
+
+                if not self.running:
+                    break
+
+                frame, timestamp = self._pending
+                self._pending = None
+                self._copying = True
+
+            try:
+                self.recorder.record( frame, timestamp )
+            finally:
+                with self.cond:
+                    self._copying = False
+                    self.cond.notify_all()
+
+    def stop(self):
+        "Stop the thread, and write out the frames recorded"
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.join()
+
+        self.recorder.flush()
@@ -0,0 +1,109 @@
+"A Vision that replays recorded frames, rather than using a camera"
+import ctypes, mmap, os, time
+import vision, calibration, recorder
+from timing import monotonic
+
+def _map_file(fname):
+    "Memory-map a file privately, so that ctypes can get at its address"
+    f = open( fname, "rb" )
+    m = mmap.mmap( f.fileno(), 0, access = mmap.ACCESS_COPY )
+    f.close()
+    return m
+
+class ReplayVision(vision.Vision):
+    """Vision that takes its frames from recorded raw YUYV frames
+
+    path is either a file of frames one after another, a ring file
+    written by recorder.FrameRecorder (replayed oldest first), or a
+    directory of files containing one frame each (replayed in filename
+    order).  All the frames must be at the resolution res, which for a
+    ring file comes from the file instead.  Frames are delivered
+    at rate frames per second (or as fast as possible if rate is None),
+    going back to the start after the last one.  focal_length is a
+    dict of focal lengths by resolution, as for vision.C500_focal_length."""
+    def __init__(self, path, res, lib, rate = None,
+                 focal_length = vision.C500_focal_length, **kw):
+        self._path = path
+        self._replay_res = res
+        self._focal_length = focal_length
+        self.rate = rate
+
+        self._frame_size = res[0] * res[1] * 2
+        self._next = 0
+        self._last_time = None
+
+        vision.Vision.__init__( self, path, lib, **kw )
+
+    def _open_camera(self):
+        self._ring = None
+
+        if os.path.isdir( self._path ):
+            self._files = sorted( os.path.join( self._path, f )
+                                  for f in os.listdir( self._path ) )
+            self.nframes = len(self._files)
+        elif recorder.is_ring_file( self._path ):
+            self._files = None
+            self._ring = recorder.RingFile( _map_file( self._path ) )
+            self._ring.check()
+            self._replay_res = self._ring.res
+            self._frame_size = recorder.frame_size( self._ring.res )
+            self.nframes = self._ring.nframes
+        else:
+            self._files = None
+            self._map = _map_file( self._path )
+            self._data = (ctypes.c_uint8 * len(self._map)).from_buffer( self._map )
+            self.nframes = len(self._map) // self._frame_size
+
+        if self.nframes == 0:
+            raise Exception( "No frames found in %s" % self._path )
+
+        # The mapping of the current frame when replaying a directory
+        # (kept so that the frame stays valid until the next one)
+        self._frame_map = None
+
+        self._res = self._replay_res
+        self.camera_focal_length = calibration.CameraCalibration( self._focal_length )
+
+    def _close_camera(self):
+        pass
+
+    def _set_res(self, res):
+        if res != self._res:
+            raise ValueError( "Recorded frames are %ix%i" % self._res )
+
+    def _wait_for_frame(self):
+        "Sleep until the next frame is due"
+        if not self.rate:
+            return
+
+        now = monotonic()
+        if self._last_time is not None:
+            due = self._last_time + 1.0 / self.rate
+
+            if due > now:
+                time.sleep( due - now )
+                now = due
+
+        self._last_time = now
+
+    def _dequeue(self):
+        self._wait_for_frame()
+
+        n = self._next
+        self._next = (self._next + 1) % self.nframes
+
+        if self._ring is not None:
+            addr = self._ring.frame_address(n)
+        elif self._files is None:
+            addr = ctypes.addressof( self._data ) + n * self._frame_size
+        else:
+            m = _map_file( self._files[n] )
+            if len(m) < self._frame_size:
+                raise Exception( "%s is too short for a %ix%i frame" %
+                                 ( self._files[n], self._res[0], self._res[1] ) )
+
+            data = (ctypes.c_uint8 * len(m)).from_buffer(m)
+            self._frame_map = (m, data)
+            addr = ctypes.addressof( data )
+
+        return ctypes.cast( addr, ctypes.POINTER(ctypes.c_uint8) )
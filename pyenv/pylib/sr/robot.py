@@ -2,7 +2,7 @@
 import json, sys, optparse, time, os, glob
 import logging
 import pysric, tssric
-import motor, power, servo, ruggeduino, vision
+import motor, power, servo, ruggeduino, vision, replay
 import usbenum
 
 logger = logging.getLogger( "sr.robot" )
@@ -28,6 +28,12 @@ class NoCameraPresent(Exception):
     def __str__(self):
         return "No camera found."
 
+class NoUSBKey(Exception):
+    "There's no user USB key"
+
+    def __str__(self):
+        return "No USB key found."
+
 class AlreadyInitialised(Exception):
     "The robot has been initialised twice"
     def __str__(self):
@@ -131,8 +137,8 @@ class Robot(object):
             "No webcam"
             return
 
-        # For now, just display the fact we have a webcam
-        logger.info( " - Webcam" )
+        for name in sorted( self.cameras.keys() ):
+            logger.info( " - Webcam: %s", name )
 
     def _dump_usbdev_dict(self, devdict, name ):
         "Write the contents of a device dict to stdout"
@@ -278,7 +284,23 @@ class Robot(object):
         return srdevs
 
     def _init_vision(self, camdev = "/dev/video0"):
-        if not os.path.exists(camdev):
+        """Create a Vision for every camera
+        self.vision is that of camdev (or, if it isn't connected, the
+        first camera found), and self.cameras holds them all, indexed by
+        device name (e.g. "video0").  Other cameras that fail to open, or
+        that have no calibration, are logged and left out."""
+        # Recorded frames can be replayed in place of the camera
+        replay_path = os.environ.get( "SR_VISION_REPLAY" )
+
+        if replay_path is not None:
+            camdevs = [camdev]
+        else:
+            camdevs = vision.list_cameras()
+
+            if os.path.exists(camdev) and camdev not in camdevs:
+                camdevs.insert( 0, camdev )
+
+        if len(camdevs) == 0:
             "Camera isn't connected."
             return
 
@@ -292,17 +314,130 @@ class Robot(object):
                     libpath = os.path.abspath(d)
                     break
 
-        if libpath == None:
-            v = vision.Vision(camdev)
+        if camdev in camdevs:
+            default = camdev
         else:
-            v = vision.Vision(camdev, libpath)
+            default = camdevs[0]
+
+        self.cameras = {}
+        for dev in camdevs:
+            if replay_path is not None:
+                v = self._init_replay_vision( replay_path, libpath )
+            elif dev == default:
+                "Failing to open the main camera is still an error"
+                v = self._open_camera( dev, libpath )
+            else:
+                try:
+                    v = self._open_camera( dev, libpath )
+                except Exception:
+                    logger.exception( "Failed to open camera %s", dev )
+                    continue
+
+                if v.camera_focal_length is None:
+                    logger.warning( "Camera %s isn't calibrated, so isn't used", dev )
+                    continue
+
+            self.cameras[ os.path.basename(dev) ] = v
+
+        self.vision = self.cameras[ os.path.basename(default) ]
+
+    def _open_camera(self, dev, libpath):
+        if libpath == None:
+            return vision.Vision(dev)
+
+        return vision.Vision(dev, libpath)
+
+    def _init_replay_vision(self, path, libpath):
+        """Create a ReplayVision, configured by environment variables:
+         - SR_VISION_REPLAY: The file or directory of frames
+         - SR_VISION_REPLAY_RES: The frames' resolution (default 800x600)
+         - SR_VISION_REPLAY_FPS: The frame rate (default 30)"""
+        res = os.environ.get( "SR_VISION_REPLAY_RES", "800x600" )
+        res = tuple( int(x) for x in res.split("x") )
+        rate = float( os.environ.get( "SR_VISION_REPLAY_FPS", "30" ) )
+
+        if libpath == None:
+            "Look for libkoki in the current directory"
+            libpath = "."
+
+        logger.info( "Replaying frames from %s", path )
+        return replay.ReplayVision( path, res, libpath, rate = rate )
+
+    def record_vision(self, res = (800,600), slots = 30,
+                      fname = "vision-frames.ring"):
+        """Record the camera's frames onto the USB key
+        The most recent slots frames captured at resolution res are
+        kept, in fname on the USB key (see sr.recorder).  These can be
+        replayed by setting SR_VISION_REPLAY to the file.  The whole file
+        is allocated up front: each slot takes res[0] * res[1] * 2 bytes
+        (nearly 1MB at 800x600)."""
+        if not hasattr( self, "vision" ):
+            raise NoCameraPresent()
+
+        if self.usbkey is None:
+            raise NoUSBKey()
 
-        self.vision = v
+        self.vision.start_recording( os.path.join( self.usbkey, fname ),
+                                     res, slots )
 
-    def see(self, res = (800,600), stats = False):
+    def see(self, res = (800,600), stats = False, roi = None, coarse_res = None):
         if not hasattr( self, "vision" ):
             raise NoCameraPresent()
 
         return self.vision.see( res = res,
                                 mode = self.mode,
-                                stats = stats )
+                                stats = stats,
+                                roi = roi,
+                                coarse_res = coarse_res )
+
+    def see_all(self, res = (800,600), stats = False):
+        """Look for markers with all the cameras at once
+        Returns one list of markers, sorted by timestamp, each with a
+        camera attribute naming the camera that saw it (e.g. "video0")."""
+        if not hasattr( self, "vision" ):
+            raise NoCameraPresent()
+
+        return vision.see_all( self.cameras,
+                               mode = self.mode,
+                               res = res,
+                               stats = stats )
+
+    def see_async(self, res = (800,600), stats = False, roi = None,
+                  coarse_res = None, callback = None):
+        """Look for markers without blocking
+        Returns a future, whose result() is what see() would return.
+        If given, callback is called with the future once it's done."""
+        if not hasattr( self, "vision" ):
+            raise NoCameraPresent()
+
+        future = self.vision.see_async( res = res,
+                                        mode = self.mode,
+                                        stats = stats,
+                                        roi = roi,
+                                        coarse_res = coarse_res )
+        if callback is not None:
+            future.add_done_callback( callback )
+
+        return future
+
+    def see_colour(self, colours, res = (800,600), stats = False, markers = False):
+        "Find blobs of the given colours (see sr.colour)"
+        if not hasattr( self, "vision" ):
+            raise NoCameraPresent()
+
+        return self.vision.see_colour( res = res,
+                                       mode = self.mode,
+                                       colours = colours,
+                                       stats = stats,
+                                       markers = markers )
+
+    def stream(self, res = (800,600), stats = False, depth = 2, workers = 2):
+        "Generator that continuously yields the markers that can be seen"
+        if not hasattr( self, "vision" ):
+            raise NoCameraPresent()
+
+        return self.vision.stream( res = res,
+                                   mode = self.mode,
+                                   stats = stats,
+                                   depth = depth,
+                                   workers = workers )
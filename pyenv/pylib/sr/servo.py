@@ -38,11 +38,26 @@ class Servo(object):
 
         return self._get_angle(idx)
 
+    def set_many(self, angles):
+        """Set several servos at once
+        angles is a dict of angles, indexed by servo number.  The commands
+        are all sent together, rather than waiting for each reply."""
+        txs = []
+        for idx, val in angles.iteritems():
+            if idx > SERVO_COUNT-1 or idx < 0:
+                raise IndexError("There are only 8 servo outputs on a servo board")
+
+            txs.append( self._set_angle_tx( idx, max( 0, min( SERVO_API_ANGLE, val ) ) ) )
+
+        self.dev.txrx_many(txs)
+
+    def _set_angle_tx(self, idx, val):
+        tmp = int(val * (SERVO_ANGLE/SERVO_API_ANGLE))
+        return [CMD_SERVO_SET, idx, tmp & 0xff, (tmp >> 8) & 0xff]
+
     def _set_angle(self, idx, val):
         """Set the angle of a given servo"""
-        tmp = int(val * (SERVO_ANGLE/SERVO_API_ANGLE))
-        tx = [CMD_SERVO_SET, idx, tmp & 0xff, (tmp >> 8) & 0xff]
-        self.dev.txrx(tx)
+        self.dev.txrx( self._set_angle_tx( idx, val ) )
 
     def _get_angle(self, idx):
         """Get the currently set angle for a given servo"""
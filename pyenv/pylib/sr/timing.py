@@ -0,0 +1,118 @@
+"Monotonic timing, and rolling statistics of timings"
+import collections, ctypes, json, logging, threading, time
+
+CLOCK_MONOTONIC = 1
+
+class _timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+def _load_clock_gettime():
+    """Find clock_gettime() in librt (or the process's own libc), or
+    return None.  The libraries are loaded by name, as
+    ctypes.util.find_library() runs ldconfig in a child process."""
+    for name in [ "librt.so.1", None ]:
+        try:
+            lib = ctypes.CDLL( name, use_errno = True )
+            f = lib.clock_gettime
+        except (OSError, AttributeError):
+            continue
+
+        f.argtypes = [ ctypes.c_int, ctypes.POINTER(_timespec) ]
+        f.restype = ctypes.c_int
+        return f
+
+    return None
+
+_clock_gettime = _load_clock_gettime()
+
+def monotonic():
+    """Return the time in seconds from a clock that never goes backwards
+    (Falls back to the wall clock if clock_gettime() isn't available.)"""
+    if _clock_gettime is None:
+        return time.time()
+
+    t = _timespec()
+    if _clock_gettime( CLOCK_MONOTONIC, ctypes.byref(t) ) != 0:
+        return time.time()
+
+    return t.tv_sec + t.tv_nsec * 1e-9
+
+class RollingStats(object):
+    "Statistics of the most recent samples of something"
+    def __init__(self, size = 500):
+        self.samples = collections.deque( maxlen = size )
+        # The number of samples ever added
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, value):
+        with self.lock:
+            self.samples.append(value)
+            self.count += 1
+
+    def percentile(self, p):
+        "The p'th percentile of the recent samples, or None if there are none"
+        with self.lock:
+            values = sorted( self.samples )
+
+        if len(values) == 0:
+            return None
+
+        return values[ min( len(values) - 1, int( p / 100.0 * len(values) ) ) ]
+
+    def summary(self):
+        "A dict of statistics of the recent samples"
+        with self.lock:
+            values = sorted( self.samples )
+            count = self.count
+
+        if len(values) == 0:
+            return { "count": count }
+
+        def pc(p):
+            return values[ min( len(values) - 1, int( p / 100.0 * len(values) ) ) ]
+
+        return { "count": count,
+                 "mean": sum(values) / len(values),
+                 "max": values[-1],
+                 "p50": pc(50),
+                 "p95": pc(95),
+                 "p99": pc(99) }
+
+class Profile(object):
+    """Rolling statistics of the time taken by a set of named stages"""
+    def __init__(self, stages, size = 500):
+        self.stages = stages
+        self.size = size
+        self.reset()
+
+    def reset(self):
+        self._stats = dict( ( s, RollingStats( self.size ) ) for s in self.stages )
+
+    def add(self, times):
+        "Add the timings in a dict of stage times (other keys are ignored)"
+        for stage, t in times.iteritems():
+            if stage in self._stats:
+                self._stats[stage].add(t)
+
+    def __getitem__(self, stage):
+        return self._stats[stage]
+
+    def summary(self):
+        "A dict of the statistics of each stage"
+        return dict( ( s, st.summary() ) for s, st in self._stats.iteritems() )
+
+    def to_json(self):
+        return json.dumps( self.summary(), sort_keys = True )
+
+    def log(self, logger, level = logging.INFO):
+        "Write the statistics of each stage that's been timed to the logger"
+        for stage in self.stages:
+            s = self._stats[stage].summary()
+            if s["count"] == 0:
+                continue
+
+            logger.log( level,
+                        "%s: n=%i p50=%.1fms p95=%.1fms p99=%.1fms max=%.1fms",
+                        stage, s["count"], s["p50"] * 1000, s["p95"] * 1000,
+                        s["p99"] * 1000, s["max"] * 1000 )
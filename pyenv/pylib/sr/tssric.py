@@ -1,5 +1,14 @@
 "pysric but with some threadlocal storage layered ontop"
-import pysric, threading
+import pysric, threading, logging, time
+
+logger = logging.getLogger( "sr.tssric" )
+
+# How long, in ms, the notification listener waits for a notification
+# before checking for new subscriptions
+NOTE_POLL_TIMEOUT = 100
+
+# The number of notes a device can have (the bits of its note flags)
+NOTE_FLAGS_BITS = 64
 
 class TSSricDevice(object):
     """A wrapper around a SRIC device that uses a threadlocal sricd connection"""
@@ -26,6 +35,13 @@ class TSSricDevice(object):
         self._pop_myself()
         return self._tl.dev.txrx( *args, **kw )
 
+    def subscribe(self, note, callback):
+        "Call callback( address, note, payload ) on each of this device's note"
+        self._sricman.notes.subscribe( self._address, note, callback )
+
+    def unsubscribe(self, note, callback):
+        self._sricman.notes.unsubscribe( self._address, note, callback )
+
 class LockableDev(TSSricDevice):
     """A TSSricDevice with a lock for its users to use
 
@@ -50,19 +66,145 @@ class LockableDev(TSSricDevice):
         assert self.lock.locked()
         return super( LockableDev, self ).txrx( *args, **kw )
 
+class NoteListener(threading.Thread):
+    """Thread that receives SRIC notifications, and calls their callbacks
+
+    The thread has its own sric context, whose note flags for each
+    device are updated as callbacks are (un)subscribed.  Callbacks are
+    called from this thread, so shouldn't take long."""
+    def __init__(self, sricman):
+        threading.Thread.__init__(self)
+
+        # Allow things to quit even if this thread persists
+        self.daemon = True
+
+        self._sricman = sricman
+        self.running = True
+        self.lock = threading.Lock()
+
+        # Lists of callbacks, indexed by (address, note)
+        self.callbacks = {}
+        # Bitmasks of the notes subscribed to, indexed by address
+        self.flags = {}
+        # Addresses whose flags the thread has to set
+        self._changed = set()
+
+    def subscribe(self, address, note, callback):
+        """Call callback( address, note, payload ) on each note from address
+        Raises pysric.SricErrorNoNotes if libsric can't do notifications."""
+        if not self._sricman.get().has_notes:
+            raise pysric.SricErrorNoNotes()
+
+        if note < 0 or note >= NOTE_FLAGS_BITS:
+            raise ValueError( "Notes are numbered from 0 to %i" % ( NOTE_FLAGS_BITS - 1 ) )
+
+        key = (address, note)
+
+        with self.lock:
+            if key not in self.callbacks:
+                self.callbacks[key] = []
+                self.flags[address] = self.flags.get( address, 0 ) | ( 1 << note )
+                self._changed.add( address )
+
+            self.callbacks[key].append( callback )
+
+    def unsubscribe(self, address, note, callback):
+        key = (address, note)
+
+        with self.lock:
+            cbs = self.callbacks.get( key, [] )
+            if callback in cbs:
+                cbs.remove( callback )
+
+            if key in self.callbacks and len(cbs) == 0:
+                del self.callbacks[key]
+                self.flags[address] &= ~( 1 << note )
+                self._changed.add( address )
+
+    def _update_registrations(self, ps):
+        "Set the note flags of the devices whose subscriptions have changed"
+        with self.lock:
+            changed = [ ( address, self.flags[address] )
+                        for address in self._changed ]
+            self._changed = set()
+
+        for address, flags in changed:
+            try:
+                ps.note_set_flags( address, flags )
+            except Exception:
+                logger.exception( "Failed to set the note flags of device %i",
+                                  address )
+
+    def _poll(self):
+        "Wait for a notification, and call its callbacks"
+        ps = self._sricman.get()
+        self._update_registrations( ps )
+
+        n = ps.poll_note( NOTE_POLL_TIMEOUT )
+        if n is None:
+            return
+
+        address, note, payload = n
+        with self.lock:
+            cbs = list( self.callbacks.get( (address, note), [] ) )
+
+        for cb in cbs:
+            try:
+                cb( address, note, payload )
+            except Exception:
+                logger.exception( "Exception in note callback" )
+
+    def run(self):
+        while self.running:
+            try:
+                self._poll()
+            except Exception:
+                logger.exception( "Failed to receive notifications" )
+
+                # Don't spin if the failure persists
+                time.sleep( NOTE_POLL_TIMEOUT / 1000.0 )
+
+    def stop(self):
+        self.running = False
+        self.join()
+
 class SricCtxMan(object):
     """Class for storing/managing one sric context per thread"""
     def __init__(self):
         self.store = threading.local()
         self._devices_populated = False
 
+        # Shared by every thread's context
+        self.policy = pysric.RetryPolicy()
+        self.stats = pysric.SricStats()
+
+        # Notification listener, started when first needed
+        self._notes = None
+        self._notes_lock = threading.Lock()
+
+    @property
+    def notes(self):
+        "The NoteListener, for subscribing to device notifications"
+        with self._notes_lock:
+            if self._notes is None:
+                self._notes = NoteListener(self)
+                self._notes.start()
+
+        return self._notes
+
     def get(self):
         "Return a pysric context for use in this thread"
         if "ctx" not in self.store.__dict__:
-            self.store.ctx = pysric.PySric()
+            self.store.ctx = pysric.PySric( policy = self.policy,
+                                            stats = self.stats )
 
         return self.store.ctx
 
+    def txrx_many(self, transactions, timeout = None):
+        """Perform several (address, data) transactions, possibly on
+        different devices, at once (see PySric.txrx_many)"""
+        return self.get().txrx_many( transactions, timeout )
+
     def get_addr_nts(self, addr):
         """Return the SricDevice instance for the given address for this thread
         (returned object is not thread-safe)"""
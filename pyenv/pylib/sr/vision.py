@@ -1,6 +1,11 @@
-import pykoki, threading, time, functools, re, subprocess
+import logging, math, pykoki, pyudev, threading, time, Queue, select
+import calibration, colour, controls, recorder, timing
+from timing import monotonic
 from collections import namedtuple
 from pykoki import CameraParams, Point2Df, Point2Di
+from ctypes import c_float, c_uint8, sizeof, string_at
+
+logger = logging.getLogger( "sr.vision" )
 
 C500_focal_length = {
     (1280, 1024): (1088.6744696128017, 1088.6744696128017),
@@ -42,6 +47,62 @@ focal_length_lut = {
     (0x046d, 0x0825): C270_focal_length
 }
 
+# (vendor, product) USB IDs of cameras, indexed by device file
+_usb_id_cache = {}
+
+def camera_usb_id(camdev):
+    """Return the (vendor, product) USB IDs of the given camera device
+    Returns None if it isn't a USB device, or udev doesn't know of it
+    (pyudev's DeviceNotFoundError, like KeyError, is a LookupError)."""
+    if camdev in _usb_id_cache:
+        return _usb_id_cache[camdev]
+
+    usb_id = None
+    try:
+        dev = pyudev.Device.from_device_file( pyudev.Context(), camdev )
+        usbdev = dev.find_parent( "usb", "usb_device" )
+
+        if usbdev is not None:
+            usb_id = ( int( usbdev.attributes["idVendor"], 16 ),
+                       int( usbdev.attributes["idProduct"], 16 ) )
+    except (ValueError, LookupError, EnvironmentError):
+        pass
+
+    _usb_id_cache[camdev] = usb_id
+    return usb_id
+
+def list_cameras():
+    "Return a sorted list of the device files of the V4L2 capture devices"
+    cams = []
+    for dev in pyudev.Context().list_devices( subsystem = "video4linux" ):
+        # Devices without the capture capability are e.g. metadata nodes
+        if ":capture:" not in dev.get( "ID_V4L_CAPABILITIES", "" ):
+            continue
+
+        if dev.device_node is not None:
+            cams.append( str(dev.device_node) )
+
+    cams.sort()
+    return cams
+
+def load_calibration(usb_id):
+    """Return the CameraCalibration for the camera with the given USB IDs
+    Resolutions calibrated in the calibration file override the built-in
+    focal_length_lut, which provides the rest.  Returns None if the
+    camera is unknown."""
+    focal_lengths = dict( focal_length_lut.get( usb_id, {} ) )
+
+    cal = calibration.load().get( calibration.usb_id_key(usb_id) )
+    name = None
+    if cal is not None:
+        focal_lengths.update( cal.focal_lengths )
+        name = cal.name
+
+    if len(focal_lengths) == 0:
+        return None
+
+    return calibration.CameraCalibration( focal_lengths, name = name )
+
 MARKER_ARENA, MARKER_ROBOT, MARKER_SLOT, MARKER_TOKEN_TOP, \
 MARKER_TOKEN_BOTTOM, MARKER_TOKEN_SIDE = range(0,6)
 
@@ -70,6 +131,9 @@ PolarCoord = namedtuple( "PolarCoord", "length rot_x rot_y" )
 Orientation = namedtuple( "Orientation", "rot_x rot_y rot_z" )
 Point = namedtuple( "Point", "image world polar" )
 
+# libkoki does not yet provide polar coords for vertices
+NO_POLAR = PolarCoord( 0, 0, 0 )
+
 def create_marker_lut(offset):
     lut = {}
     for genre, num in [ ( MARKER_ARENA, 28 ),
@@ -92,6 +156,31 @@ def create_marker_lut(offset):
 marker_luts = { "dev": create_marker_lut(0),
                 "comp": create_marker_lut(100) }
 
+def create_marker_table(lut):
+    """Flatten a marker LUT into a list indexed by (real) marker code
+    Codes that aren't in the LUT have None."""
+    table = [None] * 256
+    for code, info in lut.iteritems():
+        table[code] = info
+    return table
+
+# The flat tables are what detection uses, both to filter the markers
+# libkoki finds and (via marker_widths) to give it their widths
+marker_tables = dict( (mode, create_marker_table(lut))
+                      for mode, lut in marker_luts.iteritems() )
+
+# Width given to libkoki for codes that aren't in the LUT
+# (We really want to ignore these...)
+UNKNOWN_MARKER_WIDTH = 0.1
+
+def create_width_table(table):
+    "Create a list of marker widths from a flat marker table"
+    return [ UNKNOWN_MARKER_WIDTH if info is None else info.size
+             for info in table ]
+
+marker_widths = dict( (mode, create_width_table(table))
+                      for mode, table in marker_tables.iteritems() )
+
 MarkerBase = namedtuple( "Marker", "info timestamp res vertices centre orientation" ) 
 class Marker(MarkerBase):
     def __init__( self, *a, **kwd ):
@@ -99,172 +188,1432 @@ class Marker(MarkerBase):
         self.dist = self.centre.polar.length
         self.rot_y = self.centre.polar.rot_y
 
+def _float_offset(struct, *path):
+    "Offset, in floats, of the (nested) field given by path in struct"
+    off = 0
+    for name in path:
+        field = getattr( struct, name )
+        off += field.offset
+        struct = dict( struct._fields_ )[name]
+
+    return off / sizeof(c_float)
+
+class MarkerTable(object):
+    """The markers found by libkoki, read in bulk into flat lists
+
+    libkoki's markers are, after the code, made entirely of floats.  So
+    the whole ctypes marker array is read as one list of floats (and one
+    of codes), instead of creating ctypes objects field by field."""
+    STRIDE = sizeof(pykoki.Marker) / sizeof(c_float)
+    CENTRE = _float_offset( pykoki.Marker, "centre" )
+    VERTICES = _float_offset( pykoki.Marker, "vertices" )
+    VERTEX_STRIDE = sizeof(pykoki.MarkerVertex) / sizeof(c_float)
+    WORLD = _float_offset( pykoki.MarkerVertex, "world" )
+    ROTATION = _float_offset( pykoki.Marker, "rotation" )
+    BEARING = _float_offset( pykoki.Marker, "bearing" )
+    DISTANCE = _float_offset( pykoki.Marker, "distance" )
+
+    def __init__(self, markers):
+        "markers is a ctypes array of pykoki.Marker"
+        self.count = len(markers)
+        self.codes = []
+        self.floats = []
+
+        if self.count:
+            size = sizeof(pykoki.Marker)
+            self.codes = (c_uint8 * (self.count * size)).from_buffer(markers)[::size]
+            self.floats = (c_float * (self.count * self.STRIDE)).from_buffer(markers)[:]
+
+    def _image_offsets(self, n):
+        "The offsets of the image coords of marker n's centre and vertices"
+        base = n * self.STRIDE
+        v = base + self.VERTICES
+        return [ base + self.CENTRE ] + range( v, v + 4 * self.VERTEX_STRIDE,
+                                                self.VERTEX_STRIDE )
+
+    def to_frame(self, offset, scale):
+        """Map image coords from a scaled region of a frame to the frame
+        offset is the position of the region in the frame, and scale is
+        the size of the region's image relative to the region."""
+        if offset == (0, 0) and scale == 1:
+            return
+
+        f = self.floats
+        for n in range(self.count):
+            for off in self._image_offsets(n):
+                f[off] = f[off] / scale + offset[0]
+                f[off+1] = f[off+1] / scale + offset[1]
+
+    def bounds(self, table):
+        "Bounding boxes of the vertices of the markers in the marker table"
+        f = self.floats
+        ret = []
+
+        for n, code in enumerate(self.codes):
+            if table[code] is None:
+                continue
+
+            offs = self._image_offsets(n)[1:]
+            xs = [ f[off] for off in offs ]
+            ys = [ f[off+1] for off in offs ]
+            ret.append( ( min(xs), min(ys), max(xs), max(ys) ) )
+
+        return ret
+
+    def _point(self, off, polar):
+        f = self.floats
+        w = off + self.WORLD
+        return Point( ImageCoord( f[off], f[off+1] ),
+                      WorldCoord( f[w], f[w+1], f[w+2] ),
+                      polar )
+
+    def to_markers(self, table, timestamp, res):
+        "Create a Marker for each entry with a code in the marker table"
+        f = self.floats
+        ret = []
+
+        for n, code in enumerate(self.codes):
+            info = table[code]
+            if info is None:
+                "Ignore other sets of codes"
+                continue
+
+            base = n * self.STRIDE
+            v = base + self.VERTICES
+            vertices = [ self._point( off, NO_POLAR )
+                         for off in range( v, v + 4 * self.VERTEX_STRIDE,
+                                           self.VERTEX_STRIDE ) ]
+
+            b = base + self.BEARING
+            centre = self._point( base + self.CENTRE,
+                                  PolarCoord( length = f[base + self.DISTANCE],
+                                              rot_x = f[b],
+                                              rot_y = f[b+1] ) )
+
+            r = base + self.ROTATION
+            orientation = Orientation( f[r], f[r+1], f[r+2] )
+
+            ret.append( Marker( info = info,
+                                timestamp = timestamp,
+                                res = res,
+                                vertices = vertices,
+                                centre = centre,
+                                orientation = orientation ) )
+
+        return ret
+
+# Fraction of a marker's size added around it when searching a region
+# found by the coarse search
+COARSE_MARGIN = 0.5
+
+def _clip_box(box, res):
+    "Clip a (left, top, right, bottom) box to a frame, as integers"
+    return ( max( 0, int(box[0]) ),
+             max( 0, int(box[1]) ),
+             min( res[0], int(box[2] + 0.5) ),
+             min( res[1], int(box[3] + 0.5) ) )
+
+# Crops are grown to a multiple of this many pixels in each dimension,
+# so that there are few enough sizes for their images to be pooled
+CROP_QUANTUM = 64
+
+def _quantize_box(box, res):
+    "Grow a box to a multiple of CROP_QUANTUM in size, within the frame"
+    ret = []
+    for lo, hi, limit in [ ( box[0], box[2], res[0] ),
+                           ( box[1], box[3], res[1] ) ]:
+        size = min( limit, -( -( hi - lo ) // CROP_QUANTUM ) * CROP_QUANTUM )
+        lo = max( 0, min( lo, limit - size ) )
+        ret.append( ( lo, lo + size ) )
+
+    return ( ret[0][0], ret[1][0], ret[0][1], ret[1][1] )
+
+def _intersect_box(a, b):
+    "The intersection of two boxes, or None if they don't overlap"
+    box = ( max(a[0], b[0]), max(a[1], b[1]),
+            min(a[2], b[2]), min(a[3], b[3]) )
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return None
+    return box
+
+def _merge_boxes(boxes):
+    "Merge overlapping boxes together until none overlap"
+    boxes = list(boxes)
+    merged = True
+
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if _intersect_box(a, b) is None:
+                    continue
+
+                boxes[i] = ( min(a[0], b[0]), min(a[1], b[1]),
+                             max(a[2], b[2]), max(a[3], b[3]) )
+                del boxes[j]
+                merged = True
+                break
+
+            if merged:
+                break
+
+    return boxes
+
+def _quantize_boxes(boxes, res):
+    """Quantize boxes, merging those that then overlap, until none do
+    (Otherwise a marker in the overlap would be found twice.)"""
+    boxes = [ _quantize_box( box, res ) for box in boxes ]
+
+    while True:
+        merged = _merge_boxes( boxes )
+        if len(merged) == len(boxes):
+            return boxes
+
+        boxes = [ _quantize_box( box, res ) for box in merged ]
+
+def _scale_search(res, new_res, roi, coarse_res):
+    """Scale see()'s roi and coarse_res from res to new_res
+    The roi is grown out to whole pixels.  The coarse resolution keeps
+    the same divisor of the frame's, or is dropped if new_res isn't
+    divisible by it.  Returns (roi, coarse_res)."""
+    if new_res == res:
+        return roi, coarse_res
+
+    if roi is not None:
+        sx = float( new_res[0] ) / res[0]
+        sy = float( new_res[1] ) / res[1]
+        roi = ( int( math.floor( roi[0] * sx ) ),
+                int( math.floor( roi[1] * sy ) ),
+                int( math.ceil( roi[2] * sx ) ),
+                int( math.ceil( roi[3] * sy ) ) )
+
+    if coarse_res is not None:
+        factor = res[0] // coarse_res[0]
+        if factor >= 1 and coarse_res[0] * factor == res[0] \
+                and coarse_res[1] * factor == res[1]:
+            if new_res[0] % factor or new_res[1] % factor:
+                coarse_res = None
+            else:
+                coarse_res = ( new_res[0] // factor, new_res[1] // factor )
+
+    return roi, coarse_res
+
 class Timer(object):
     def __enter__(self):
-        self.start = time.time()
+        self.start = monotonic()
 
     def __exit__(self, t, v, tb):
-        self.time = time.time() - self.start
+        self.time = monotonic() - self.start
         return False
 
+class ImagePool(object):
+    """Pool of grayscale images that get reused from frame to frame
+
+    Images are keyed by resolution, and are only allocated when the
+    pool for that resolution is empty."""
+    def __init__(self, koki):
+        self.koki = koki
+        self._free = {}
+        self.lock = threading.Lock()
+
+        # Number of images allocated and reused over the pool's lifetime
+        self.allocs = 0
+        self.reuses = 0
+
+    def acquire(self, res):
+        "Get an image of the given resolution from the pool"
+        with self.lock:
+            free = self._free.setdefault( res, [] )
+            if len(free):
+                self.reuses += 1
+                return free.pop()
+
+            self.allocs += 1
+
+        return self.koki.image_alloc( res[0], res[1] )
+
+    def release(self, res, img):
+        "Return an image acquired with acquire() to the pool"
+        with self.lock:
+            self._free.setdefault( res, [] ).append( img )
+
+    def clear(self):
+        "Free all the images that are in the pool"
+        with self.lock:
+            for imgs in self._free.values():
+                for img in imgs:
+                    self.koki.image_free(img)
+            self._free = {}
+
+# A captured frame, converted to grayscale
+# Fields:
+#  - image: The grayscale image
+#  - res: The resolution of the image
+#  - timestamp: The time at which the frame was dequeued from the camera
+#  - mono_time: The same time from timing.monotonic(), for measuring
+#               durations that mustn't jump when the clock is set
+#  - times: Timings of the capture and conversion
+Frame = namedtuple( "Frame", "image res timestamp mono_time times" )
+
+class CaptureThread(threading.Thread):
+    """Thread that continuously captures frames from a Vision instance
+
+    Only the newest frame is kept -- older frames that haven't been
+    collected are freed as soon as a newer one arrives."""
+    def __init__(self, vision):
+        threading.Thread.__init__(self)
+
+        # Allow things to quit even if this thread persists
+        self.daemon = True
+
+        self.vision = vision
+        self.running = True
+        self.latest = None
+        self.dropped = 0
+        self.cond = threading.Condition()
+
+        # The exception that stopped the thread, if any
+        self.error = None
+
+    def run(self):
+        try:
+            self._capture()
+        except Exception, e:
+            with self.cond:
+                self.error = e
+                self.cond.notify_all()
+
+    def _capture(self):
+        while self.running:
+            t = monotonic()
+            with self.vision.lock:
+                lock_wait = monotonic() - t
+                frame = self.vision._grab()
+            frame.times["lock"] = lock_wait
+
+            with self.cond:
+                if self.latest is not None:
+                    "Nobody wanted the previous frame"
+                    self.vision._free_image( self.latest.res, self.latest.image )
+                    self.dropped += 1
+
+                self.latest = frame
+                self.cond.notify_all()
+
+    def get(self, res):
+        """Take the newest frame of the given resolution
+        Raises the capture thread's exception if it has died."""
+        with self.vision.lock:
+            self.vision._set_res(res)
+
+        with self.cond:
+            while self.latest is None or self.latest.res != res:
+                if self.error is not None:
+                    raise self.error
+
+                if not self.is_alive():
+                    raise Exception( "Capture thread has stopped" )
+
+                # Time out now and then to check the thread's still alive
+                self.cond.wait( FRAME_READY_TIMEOUT )
+
+            frame = self.latest
+            self.latest = None
+
+        return frame
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+        if self.latest is not None:
+            self.vision._free_image( self.latest.res, self.latest.image )
+            self.latest = None
+
+class Pipeline(object):
+    """Overlaps frame capture and conversion with marker detection
+
+    Iterating over a Pipeline yields (markers, times) tuples."""
+    def __init__(self, vision, mode, res, depth, workers):
+        self.vision = vision
+        self.mode = mode
+        self.res = res
+        self.running = True
+
+        # Frames waiting for detection, and the (sequence, result) pairs
+        # from detection.  Dropped frames have a result of None, and an
+        # exception in any of the threads is put as (None, exception).
+        self.frames = Queue.Queue( maxsize = depth )
+        self.results = Queue.Queue()
+
+        self.workers = []
+        for n in range(workers):
+            t = threading.Thread( target = self._work )
+            t.daemon = True
+            t.start()
+            self.workers.append(t)
+
+        self.capturer = threading.Thread( target = self._capture )
+        self.capturer.daemon = True
+        self.capturer.start()
+
+    def _capture(self):
+        try:
+            self._capture_frames()
+        except Exception, e:
+            self.results.put( (None, e) )
+
+    def _capture_frames(self):
+        seq = 0
+        while self.running:
+            res = self.res
+            gov = self.vision.governor
+            if gov is not None:
+                res = gov.res
+                self.vision._skip_frames( res, gov.skip )
+
+            frame = self.vision._capture_frame( res )
+
+            try:
+                self.frames.put_nowait( (seq, frame) )
+            except Queue.Full:
+                "Drop the oldest frame to keep the latency down"
+                try:
+                    old_seq, old = self.frames.get_nowait()
+                    self.vision._free_image( old.res, old.image )
+                    self.results.put( (old_seq, None) )
+                except Queue.Empty:
+                    pass
+
+                self.frames.put( (seq, frame) )
+
+            seq += 1
+
+    def _work(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+
+            seq, frame = item
+            try:
+                self.results.put( (seq, self.vision._detect( frame, self.mode,
+                                                             skippable = True )) )
+            except Exception, e:
+                self.results.put( (None, e) )
+
+    def __iter__(self):
+        pending = {}
+        seq = 0
+
+        while True:
+            while seq not in pending:
+                n, r = self.results.get()
+                if n is None:
+                    "A thread failed"
+                    raise r
+
+                pending[n] = r
+
+            r = pending.pop(seq)
+            seq += 1
+
+            if r is not None:
+                yield r
+
+    def stop(self):
+        "Stop all the pipeline's threads"
+        self.running = False
+        self.capturer.join()
+
+        # Free the frames that never made it to detection
+        while True:
+            try:
+                item = self.frames.get_nowait()
+            except Queue.Empty:
+                break
+
+            self.vision._free_image( item[1].res, item[1].image )
+
+        for t in self.workers:
+            self.frames.put(None)
+        for t in self.workers:
+            t.join()
+
+# The tracked state of a marker
+# Fields:
+#  - info: The MarkerInfo of the marker
+#  - position: WorldCoord of the centre of the marker
+#  - velocity: WorldCoord of the velocity of the centre, in m/s
+#  - timestamp: The time that position is for
+#  - last_seen: The timestamp of the most recent observation of the marker
+Track = namedtuple( "Track", "info position velocity timestamp last_seen" )
+
+class Tracker(object):
+    """Tracks markers from frame to frame, predicting where they are
+
+    Observations of each marker code are fused with an alpha-beta filter,
+    so where a marker is can be asked for at any time without having to
+    call see() again.  Markers not seen for max_age seconds are forgotten."""
+    def __init__(self, alpha = 0.7, beta = 0.3, max_age = 2.0):
+        self.alpha = alpha
+        self.beta = beta
+        self.max_age = max_age
+
+        # Tracks, indexed by marker code
+        self._tracks = {}
+        self.lock = threading.Lock()
+
+    def update(self, markers):
+        "Add the markers from one call to see() to the tracks"
+        with self.lock:
+            for m in markers:
+                self._update_marker(m)
+
+    def _update_marker(self, m):
+        code = m.info.code
+        pos = m.centre.world
+        t = m.timestamp
+
+        track = self._tracks.get(code)
+        if track is None or t - track.last_seen > self.max_age:
+            "Start tracking afresh"
+            self._tracks[code] = Track( info = m.info,
+                                        position = pos,
+                                        velocity = WorldCoord( 0, 0, 0 ),
+                                        timestamp = t,
+                                        last_seen = t )
+            return
+
+        dt = t - track.timestamp
+        if dt <= 0:
+            "Another view of the same instant (or an older one)"
+            return
+
+        pred = [ p + v * dt for p, v in zip( track.position, track.velocity ) ]
+        resid = [ o - p for o, p in zip( pos, pred ) ]
+
+        position = [ p + self.alpha * r for p, r in zip( pred, resid ) ]
+        velocity = [ v + (self.beta / dt) * r
+                     for v, r in zip( track.velocity, resid ) ]
+
+        self._tracks[code] = Track( info = m.info,
+                                    position = WorldCoord( *position ),
+                                    velocity = WorldCoord( *velocity ),
+                                    timestamp = t,
+                                    last_seen = t )
+
+    def predict(self, code, t = None):
+        """Predict the Track of the marker with the given code at time t
+        (defaulting to now).  Returns None if the marker isn't tracked."""
+        if t is None:
+            t = time.time()
+
+        with self.lock:
+            track = self._tracks.get(code)
+
+        if track is None or t - track.last_seen > self.max_age:
+            return None
+
+        dt = t - track.timestamp
+        pos = [ p + v * dt for p, v in zip( track.position, track.velocity ) ]
+        return track._replace( position = WorldCoord( *pos ),
+                               timestamp = t )
+
+    def predict_all(self, t = None):
+        "Predict the Tracks of all the tracked markers at time t"
+        if t is None:
+            t = time.time()
+
+        with self.lock:
+            codes = self._tracks.keys()
+
+        return [ tr for tr in ( self.predict( c, t ) for c in codes )
+                 if tr is not None ]
+
+# Resolutions the governor chooses between, most detailed first
+GOVERNOR_RESOLUTIONS = [ (800,600), (640,480), (320,240) ]
+
+# The governor only makes detection more expensive again when its
+# latency is expected to stay below this fraction of the target
+GOVERNOR_HEADROOM = 0.7
+
+class Governor(object):
+    """Chooses the resolution and frame skip to hold a latency target
+
+    The latency of each frame (from capture until its markers are found)
+    is averaged.  When the average is over target seconds, the
+    resolution is stepped down, and then, once at the lowest, frames are
+    skipped to leave more CPU time for those that aren't (only where
+    frames are skipped, i.e. by stream()).  When there's plenty of
+    headroom, these are undone in reverse.  After each change, settle
+    frames are left to show its effect before the next."""
+    def __init__(self, target, resolutions = GOVERNOR_RESOLUTIONS,
+                 max_skip = 3, alpha = 0.3, settle = 3):
+        self.target = target
+        self.resolutions = list(resolutions)
+        self.max_skip = max_skip
+        self.alpha = alpha
+        self.settle = settle
+
+        # Index into resolutions of the one in use
+        self.level = 0
+        # Frames to skip after each one used
+        self.skip = 0
+        # Average latency since the last change
+        self.latency = None
+
+        self._hold = settle
+        self.lock = threading.Lock()
+
+    @property
+    def res(self):
+        return self.resolutions[ self.level ]
+
+    def _change(self, level, skip):
+        self.level = level
+        self.skip = skip
+        self.latency = None
+        self._hold = self.settle
+
+    def _decide(self, skippable):
+        "Make any change needed, returning what was done"
+        lat = self.latency
+
+        if lat > self.target:
+            if self.level + 1 < len(self.resolutions):
+                self._change( self.level + 1, self.skip )
+                return "res_down"
+
+            if skippable and self.skip < self.max_skip:
+                self._change( self.level, self.skip + 1 )
+                return "skip_up"
+
+            return "saturated"
+
+        if lat < self.target * GOVERNOR_HEADROOM:
+            if self.skip > 0:
+                self._change( self.level, self.skip - 1 )
+                return "skip_down"
+
+            if self.level > 0:
+                cur = self.res
+                up = self.resolutions[ self.level - 1 ]
+
+                # Detection cost goes roughly with the number of pixels
+                ratio = float( up[0] * up[1] ) / ( cur[0] * cur[1] )
+                if lat * ratio < self.target * GOVERNOR_HEADROOM:
+                    self._change( self.level - 1, self.skip )
+                    return "res_up"
+
+        return "hold"
+
+    def update(self, res, latency, skippable = False):
+        """Add the latency of a frame captured at res, and decide
+        skippable is whether the frame came from somewhere that applies
+        the frame skip.  Returns a dict of the decision and the state it
+        was made in."""
+        with self.lock:
+            if res != self.res:
+                "From before the last change"
+                decision = "stale"
+            else:
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency += self.alpha * ( latency - self.latency )
+
+                self._hold -= 1
+                if self._hold > 0:
+                    decision = "settling"
+                else:
+                    decision = self._decide( skippable )
+
+            return { "decision": decision,
+                     "latency": latency,
+                     "average": self.latency,
+                     "target": self.target,
+                     "res": self.res,
+                     "skip": self.skip }
+
+class ResultTimeout(Exception):
+    "The result of an asynchronous see() didn't arrive in time"
+    def __str__(self):
+        return "Timed out waiting for vision result."
+
+class ResultSuperseded(Exception):
+    """An asynchronous see() was replaced by a different request before
+    the worker got to it"""
+    def __str__(self):
+        return "Vision request superseded by a newer one."
+
+class VisionFuture(object):
+    "The result of an asynchronous see(), which will be available later"
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        "Whether the result is available yet"
+        with self._cond:
+            return self._done
+
+    def result(self, timeout = None):
+        """Wait for, and return, the result
+        Raises ResultTimeout if it isn't available within timeout seconds,
+        or the exception that see() raised."""
+        with self._cond:
+            if not self._done:
+                self._cond.wait(timeout)
+
+            if not self._done:
+                raise ResultTimeout()
+
+            if self._exception is not None:
+                raise self._exception
+
+            return self._result
+
+    def add_done_callback(self, fn):
+        """Call fn with this future once the result is available
+        (Called from the vision worker thread, or now if already done.
+        Exceptions that fn raises in the worker thread are logged.)"""
+        with self._cond:
+            if not self._done:
+                self._callbacks.append(fn)
+                return
+
+        fn(self)
+
+    def _set(self, result, exception):
+        with self._cond:
+            self._result = result
+            self._exception = exception
+            self._done = True
+            self._cond.notify_all()
+
+            callbacks = self._callbacks
+            self._callbacks = []
+
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                logger.exception( "Exception in vision future callback" )
+
+class AsyncWorker(threading.Thread):
+    """Thread that runs see() requests in the background
+
+    Only the latest request is kept.  Waiting requests with the same
+    arguments as a new one are given its result; waiting requests with
+    different arguments fail with ResultSuperseded."""
+    def __init__(self, vision):
+        threading.Thread.__init__(self)
+
+        # Allow things to quit even if this thread persists
+        self.daemon = True
+
+        self.vision = vision
+        self.running = True
+        self.cond = threading.Condition()
+
+        # (see() keyword arguments, [futures]) of the waiting request
+        self._pending = None
+
+    def submit(self, **kw):
+        "Queue a see() with the given arguments, returning a VisionFuture"
+        future = VisionFuture()
+        superseded = []
+
+        with self.cond:
+            futures = [future]
+            if self._pending is not None:
+                if self._pending[0] == kw:
+                    "The waiting request wants the same result"
+                    futures = self._pending[1] + futures
+                else:
+                    superseded = self._pending[1]
+
+            self._pending = ( kw, futures )
+            self.cond.notify()
+
+        for f in superseded:
+            f._set( None, ResultSuperseded() )
+
+        return future
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self._pending is None and self.running:
+                    self.cond.wait()
+
+                if not self.running:
+                    break
+
+                kw, futures = self._pending
+                self._pending = None
+
+            try:
+                result = self.vision.see( **kw )
+                exception = None
+            except Exception, e:
+                result = None
+                exception = e
+
+            for f in futures:
+                f._set( result, exception )
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.join()
+
+def see_all(cameras, mode, res, stats = False):
+    """Look for markers with several cameras at once
+
+    cameras is a dict of Visions, indexed by name.  Each camera captures
+    and detects in its own thread (libkoki runs without the GIL, so these
+    spread across cores).  Returns one list of markers, sorted by
+    timestamp, each with a camera attribute holding its camera's name.
+    If stats is True, a dict of each camera's times is returned too.
+
+    Cameras that have no calibration, or fail, are logged and left out;
+    an exception is only raised if none of the cameras worked."""
+    results = {}
+    errors = []
+
+    def see_one(name, v):
+        try:
+            results[name] = v.see( mode, res, True )
+        except Exception, e:
+            logger.exception( "Camera %s failed to look for markers", name )
+            errors.append(e)
+
+    threads = []
+    for name, v in cameras.iteritems():
+        if v.camera_focal_length is None:
+            logger.warning( "Camera %s isn't calibrated, so is skipped", name )
+            continue
+
+        t = threading.Thread( target = see_one, args = (name, v) )
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    for t in threads:
+        t.join()
+
+    if len(results) == 0 and len(errors):
+        raise errors[0]
+
+    markers = []
+    times = {}
+    for name, (cam_markers, cam_times) in results.iteritems():
+        for m in cam_markers:
+            m.camera = name
+
+        markers += cam_markers
+        times[name] = cam_times
+
+    markers.sort( key = lambda m: m.timestamp )
+
+    if stats:
+        return (markers, times)
+
+    return markers
+
+# The stages of vision that Vision.profile keeps statistics for:
+#  - lock: Waiting for the camera lock
+#  - res_switch: Changing the camera's resolution
+#  - record: Waiting for the recorder to finish with the previous frame
+#  - cam: Waiting for the camera to provide a frame
+#  - yuyv: Converting the frame to grayscale
+#  - age: The age of the frame when detection started
+#  - coarse: The downscaled search for markers (when used)
+#  - find_markers: Marker detection in libkoki
+#  - convert: Converting libkoki's markers to Python objects
+#  - colour: Colour blob detection (when used)
+PROFILE_STAGES = [ "lock", "res_switch", "cam", "record", "yuyv", "age",
+                   "coarse", "find_markers", "convert", "colour" ]
+
+# How long to wait for a frame after changing resolution without
+# reopening the camera, before deciding that the camera needs reopening
+FRAME_READY_TIMEOUT = 1.0
+
+class ResSession(object):
+    "What we've learnt about switching the camera to a resolution"
+    def __init__(self, fast):
+        # Whether the format can be set without reopening the camera
+        self.fast = fast
+
+        # The number of switches to the resolution, and the time the
+        # last one took
+        self.switches = 0
+        self.switch_time = None
+
 class Vision(object):
-    def __init__(self, camdev, lib):
+    def __init__(self, camdev, lib, zero_copy = False,
+                 buffers = 1, threaded = False):
         self.koki = pykoki.PyKoki(lib)
         self._camdev = camdev
-        self.fd = self.koki.v4l_open_cam(self._camdev)
-        self.camera_focal_length = None
-        self._init_focal_length()
 
-        if self.fd < 0:
-            raise Exception("Couldn't open camera: %s" % ctypes.get_errno() )
+        # The number of buffers in the camera's streaming ring
+        self._nbuffers = buffers
+        self._buffer_count = 0
+
+        # When zero_copy is set, grayscale images come from the pool
+        # rather than being allocated and freed for every frame
+        self.zero_copy = zero_copy
+        self.pool = ImagePool(self.koki)
+        self.allocs = 0
+        self._frame = None
+
+        # Width callbacks handed to libkoki, indexed by mode
+        self._width_funcs = {}
+
+        # Rolling statistics of how long each stage of vision takes
+        self.profile = timing.Profile( PROFILE_STAGES )
 
         # Lock for the use of the vision
         self.lock = threading.Lock()
-        self.lock.acquire()
 
         self._res = None
         self._buffers = None
         self._streaming = False
+        self._res_sessions = {}
+        self._switch_time = 0
+
+        # The recorder.FrameWriter that captured frames go to, if any
+        self.recorder = None
+
+        # Chooses resolution and frame skip, when set (see govern())
+        self.governor = None
+
+        # Exposure, gain and frame rate (see sr.controls)
+        self.controls = controls.CameraControls(self)
+
+        with self.lock:
+            self._open_camera()
+
+        # Worker for see_async(), started when first needed
+        self._async = None
+
+        self._capture = None
+        if threaded:
+            self.start_capture()
+
+    def __del__(self):
+        if self._async is not None:
+            self._async.stop()
+        self.stop_capture()
+        self.stop_recording()
+        self._close_camera()
+        self.pool.clear()
+
+    def _open_camera(self):
+        "Open the camera, and start it streaming at the default resolution"
+        self.fd = self.koki.v4l_open_cam(self._camdev)
+        self.camera_focal_length = None
+        self._init_focal_length()
+
+        if self.fd < 0:
+            raise Exception("Couldn't open camera: %s" % ctypes.get_errno() )
 
         # Default to 800x600        
         self._set_res( (800,600) )
         self._start()
-        self.lock.release()
 
-    def __del__(self):
+    def _close_camera(self):
         self._stop()
         self.koki.v4l_close_cam(self.fd)
 
+    def _dequeue(self):
+        """Wait for the camera's next frame, and return a pointer to it
+        With several buffers, older frames may already be waiting, so
+        those are skipped to get to the newest.  The recorder must have
+        finished with the camera's buffers first (see _sync_recorder)."""
+        frame = self.koki.v4l_get_frame_array( self.fd, self._buffers )
+
+        for i in range( self._buffer_count - 1 ):
+            if not self._frame_ready( 0 ):
+                break
+
+            frame = self.koki.v4l_get_frame_array( self.fd, self._buffers )
+
+        return frame
+
     def _init_focal_length(self):
-        vendor_product_re = re.compile(".* ([0-9A-Za-z]+):([0-9A-Za-z]+) ")
-        p = subprocess.Popen(["lsusb"], stdout=subprocess.PIPE)
-        stdout, _ = p.communicate()
-        for line in stdout.splitlines():
-            match = vendor_product_re.match(line)
-            id = tuple(int(x, 16) for x in match.groups())
-            if id in focal_length_lut:
-               self.camera_focal_length = focal_length_lut[id]
-               return
+        "Find the camera's calibration from its USB IDs"
+        usb_id = camera_usb_id( self._camdev )
+        if usb_id is None:
+            return
+
+        self.camera_focal_length = load_calibration( usb_id )
 
     def _set_res(self, res):
-        "Set the resolution of the camera if different to what we were"
+        """Set the resolution of the camera if different to what we were
+
+        Some drivers let us just set the new format on the open camera,
+        whilst others need the camera closing and reopening first.  What
+        works for each resolution is remembered in self._res_sessions."""
         if res == self._res:
             "Resolution already the requested one"
             return
 
+        start = monotonic()
         was_streaming = self._streaming
         if was_streaming:
             self._stop()
 
-        # The camera goes into a strop if we don't close and open again
-        self.koki.v4l_close_cam(self.fd)
-        self.fd = self.koki.v4l_open_cam(self._camdev)
+        session = self._res_sessions.get(res)
+        fast = session is None or session.fast
+        if fast:
+            fast = self._set_format( res, reopen = False )
+
+        if not fast and not self._set_format( res, reopen = True ):
+            raise ValueError( "Unsupported image resolution" )
+        self._res = res
+
+        if was_streaming:
+            self._start()
+
+            if fast and session is None and not self._frame_ready():
+                "The camera's gone into a strop -- it needs reopening"
+                self._stop()
+                self._set_format( res, reopen = True )
+                self._start()
+                fast = False
+
+            # We only know whether the fast path works once we've streamed
+            if session is None:
+                session = ResSession(fast)
+                self._res_sessions[res] = session
+
+            session.switches += 1
+            session.switch_time = monotonic() - start
+
+        self._switch_time += monotonic() - start
+
+    def _set_format(self, res, reopen):
+        """Set the camera's format to YUYV at the given resolution
+        Returns True if the camera accepted the resolution."""
+        if reopen:
+            # The camera goes into a strop if we don't close and open again
+            self.koki.v4l_close_cam(self.fd)
+            self.fd = self.koki.v4l_open_cam(self._camdev)
 
         fmt = self.koki.v4l_create_YUYV_format( res[0], res[1] )
         self.koki.v4l_set_format(self.fd, fmt)
 
         fmt = self.koki.v4l_get_format(self.fd)
-        width = fmt.fmt.pix.width
-        height = fmt.fmt.pix.height
+        if fmt.fmt.pix.width != res[0] or fmt.fmt.pix.height != res[1]:
+            return False
 
-        if width != res[0] or height != res[1]:
-            raise ValueError( "Unsupported image resolution" )
-        self._res = (width, height)
+        # Reopening, or changing format, loses some settings
+        self.controls._apply()
+        return True
 
-        if was_streaming:
-            self._start()
+    def _frame_ready(self, timeout = FRAME_READY_TIMEOUT):
+        "Wait for the camera to have a frame ready for us"
+        r, w, x = select.select( [self.fd], [], [], timeout )
+        return len(r) > 0
+
+    def _sync_recorder(self):
+        """Wait for the recorder to finish with the last frame offered to it
+        Must be done before the camera's buffers are reused or freed."""
+        if self.recorder is not None:
+            self.recorder.sync()
 
     def _stop(self):
+        self._sync_recorder()
         self.koki.v4l_stop_stream(self.fd)
-        self.koki.v4l_free_buffers(self._buffers, 1)
+        self.koki.v4l_free_buffers(self._buffers, self._buffer_count)
         self._buffers = None
         self._streaming = False
 
     def _start(self):
-        self._buffers = self.koki.v4l_prepare_buffers(self.fd, pykoki.c_int(1))
+        # The driver may give us a different number of buffers
+        count = pykoki.c_int(self._nbuffers)
+        self._buffers = self.koki.v4l_prepare_buffers(self.fd, count)
+        self._buffer_count = count.value
         self.koki.v4l_start_stream(self.fd)
         self._streaming = True
 
-    def _width_from_code(self, lut, code):
-        if code not in lut:
-            # We really want to ignore these...
-            return 0.1
+    def start_capture(self):
+        """Continuously capture frames in a background thread
 
-        return lut[code].size
+        see() then works on the newest complete frame, rather than
+        waiting for the camera's next exposure."""
+        if self._capture is not None:
+            return
 
-    def see(self, mode, res, stats):
-        self.lock.acquire()
-        self._set_res(res)
+        self._capture = CaptureThread(self)
+        self._capture.start()
 
-        acq_time = time.time()
+    def stop_capture(self):
+        "Stop the background capture thread"
+        if self._capture is None:
+            return
+
+        self._capture.stop()
+        self._capture = None
+
+    def start_recording(self, fname, res, slots):
+        """Record the raw frames captured at resolution res to fname
+        fname becomes a ring file (see sr.recorder) of slots frames,
+        holding the most recent ones."""
+        writer = recorder.FrameWriter( recorder.FrameRecorder( fname, res, slots ) )
+        writer.start()
+
+        with self.lock:
+            old = self.recorder
+            self.recorder = writer
+
+        if old is not None:
+            old.stop()
+
+    def stop_recording(self):
+        "Stop recording frames, writing out those recorded"
+        with self.lock:
+            writer = self.recorder
+            self.recorder = None
+
+        if writer is not None:
+            writer.stop()
 
+    def frame_buffer(self):
+        """Return a view of the most recently captured YUYV frame
+
+        The returned ctypes array refers directly to the camera's mmap'd
+        buffer (wrap it in a memoryview for a Python buffer).  It is only
+        valid until the next frame is captured."""
+        if self._frame is None:
+            return None
+
+        return self.koki.v4l_frame_buffer( self._frame,
+                                           self._res[0] * self._res[1] * 2 )
+
+    def _width_func(self, mode):
+        """Return the native width callback for the given mode
+
+        The callback is created once per mode, and looks the width up
+        in a flat table without going through any Python code of ours."""
+        if mode not in self._width_funcs:
+            self._width_funcs[mode] = pykoki.WIDTH_FROM_CODE_FUNC( marker_widths[mode].__getitem__ )
+
+        return self._width_funcs[mode]
+
+    def _grab(self):
+        """Capture a frame and convert it to grayscale
+        Must be called with self.lock held."""
         timer = Timer()
         times = {}
 
+        if self.recorder is not None:
+            with timer:
+                self._sync_recorder()
+            times["record"] = timer.time
+
         with timer:
-            frame = self.koki.v4l_get_frame_array( self.fd, self._buffers )
+            frame = self._dequeue()
         times["cam"] = timer.time
+        acq_time = time.time()
+        mono_time = monotonic()
+        self._frame = frame
+
+        if self.recorder is not None and self.recorder.res == self._res:
+            "The writer thread copies it whilst we get on with detection"
+            self.recorder.offer( frame, acq_time )
 
         with timer:
-            img = self.koki.v4l_YUYV_frame_to_grayscale_image( frame, self._res[0], self._res[1] )
+            if self.zero_copy:
+                allocs = self.pool.allocs
+                img = self.pool.acquire( self._res )
+                self.koki.v4l_YUYV_frame_to_grayscale_into( frame,
+                                                            self._res[0],
+                                                            self._res[1],
+                                                            img )
+                allocs = self.pool.allocs - allocs
+
+                if not self.koki.convert_into_native:
+                    "libkoki had to convert into a temporary image"
+                    allocs += 1
+            else:
+                img = self.koki.v4l_YUYV_frame_to_grayscale_image( frame, self._res[0], self._res[1] )
+                allocs = 1
         times["yuyv"] = timer.time
 
-        # Now that we're dealing with a copy of the image, release the camera lock
-        self.lock.release()
+        # Time spent changing resolution before this frame
+        times["res_switch"] = self._switch_time
+        self._switch_time = 0
+
+        # Image allocations for this frame, and since we started
+        self.allocs += allocs
+        times["allocs"] = allocs
+        times["allocs_total"] = self.allocs
+
+        return Frame( image = img,
+                      res = self._res,
+                      timestamp = acq_time,
+                      mono_time = mono_time,
+                      times = times )
+
+    def _free_image(self, res, img):
+        "Free an image that came from _grab()"
+        if self.zero_copy:
+            self.pool.release( res, img )
+        else:
+            self.koki.image_free(img)
+
+    def _capture_frame(self, res):
+        "Get a grayscale frame of the given resolution"
+        if self._capture is not None:
+            return self._capture.get(res)
+
+        t = monotonic()
+        with self.lock:
+            lock_wait = monotonic() - t
+            self._set_res(res)
+            frame = self._grab()
+
+        frame.times["lock"] = lock_wait
+        return frame
+
+    def _skip_frames(self, res, n):
+        "Let n frames go by without looking for markers in them"
+        for i in range(n):
+            if self._capture is not None:
+                frame = self._capture.get(res)
+                self._free_image( frame.res, frame.image )
+            else:
+                with self.lock:
+                    self._set_res(res)
+                    self._sync_recorder()
+                    self._dequeue()
+
+    def _find_markers(self, img, mode, res, size, offset = (0,0), scale = 1):
+        """Find the markers in img, which is a (scaled) region of a frame
+        Returns a MarkerTable, with image coords relative to the frame."""
+        if size == res:
+            params = self.camera_focal_length.params( res )
+        else:
+            fx, fy = self.camera_focal_length[ res ]
+            params = CameraParams( Point2Df( (res[0]/2 - offset[0]) * scale,
+                                             (res[1]/2 - offset[1]) * scale ),
+                                   Point2Df( fx * scale, fy * scale ),
+                                   Point2Di( *size ) )
 
-        params = CameraParams( Point2Df( self._res[0]/2,
-                                         self._res[1]/2 ),
-                               Point2Df( *self.camera_focal_length[ self._res ] ),
-                               Point2Di( *self._res ) )
+        markers = self.koki.find_markers_fp_array( img,
+                                                   self._width_func(mode),
+                                                   params,
+                                                   accept = marker_tables[mode] )
+        table = MarkerTable(markers)
+        table.to_frame( offset, scale )
+        return table
+
+    def _find_regions(self, img, mode, res, roi, coarse_res, times):
+        """Find markers in regions of img
+        The regions are the roi, and/or those around the markers found
+        in a downscaled copy of img.  Returns a list of MarkerTables."""
+        if roi is None:
+            roi = (0, 0, res[0], res[1])
+        roi = _clip_box( roi, res )
+        regions = [ roi ]
+
+        if coarse_res is not None:
+            factor = res[0] // coarse_res[0]
+            if factor < 1 or coarse_res[0] * factor != res[0] \
+                    or coarse_res[1] * factor != res[1]:
+                raise ValueError( "coarse_res must be res divided by a whole number" )
+
+            timer = Timer()
+            with timer:
+                small = self.pool.acquire( coarse_res )
+                self.koki.image_downscale_into( img, factor, small )
+                coarse = self._find_markers( small, mode, res, coarse_res,
+                                             scale = 1.0 / factor )
+                self.pool.release( coarse_res, small )
+            times["coarse"] = timer.time
+
+            regions = []
+            for box in coarse.bounds( marker_tables[mode] ):
+                margin = COARSE_MARGIN * max( box[2] - box[0], box[3] - box[1] ) + factor
+                box = _intersect_box( _clip_box( ( box[0] - margin, box[1] - margin,
+                                                   box[2] + margin, box[3] + margin ),
+                                                 res ),
+                                      roi )
+                if box is not None:
+                    regions.append(box)
+
+        regions = _quantize_boxes( regions, res )
+        times["regions"] = len(regions)
+
+        tables = []
+        for x0, y0, x1, y1 in regions:
+            size = ( x1 - x0, y1 - y0 )
+            if size == res:
+                tables.append( self._find_markers( img, mode, res, res ) )
+                continue
+
+            crop = self.pool.acquire( size )
+            self.koki.image_crop_into( img, x0, y0, size[0], size[1], crop )
+            tables.append( self._find_markers( crop, mode, res, size,
+                                               offset = (x0, y0) ) )
+            self.pool.release( size, crop )
+
+        return tables
+
+    def _detect(self, frame, mode, roi = None, coarse_res = None,
+                skippable = False):
+        """Find the markers in a frame from _capture_frame()
+        Frees the frame's image, and returns the markers and timings.
+        skippable is whether the caller applies the governor's frame skip."""
+        img = frame.image
+        res = frame.res
+        acq_time = frame.timestamp
+        timer = Timer()
+        times = dict( frame.times )
+
+        # How old the frame was by the time we started looking at it
+        times["age"] = monotonic() - frame.mono_time
 
         with timer:
-            markers = self.koki.find_markers_fp( img,
-                                                 functools.partial( self._width_from_code, marker_luts[mode] ),
-                                                 params )
+            if roi is None and coarse_res is None:
+                tables = [ self._find_markers( img, mode, res, res ) ]
+            else:
+                tables = self._find_regions( img, mode, res, roi,
+                                             coarse_res, times )
         times["find_markers"] = timer.time
 
-        srmarkers = []
-        for m in markers:
-            if m.code not in marker_luts[mode]:
-                "Ignore other sets of codes"
-                continue
+        with timer:
+            srmarkers = []
+            for table in tables:
+                srmarkers += table.to_markers( marker_tables[mode], acq_time, res )
+        times["convert"] = timer.time
+
+        self._free_image( res, img )
+        self.profile.add( times )
+
+        gov = self.governor
+        if gov is not None:
+            times["governor"] = gov.update( res, monotonic() - frame.mono_time,
+                                            skippable )
+
+        return (srmarkers, times)
+
+    def govern(self, target, **kw):
+        """Hold the latency of see() and stream() to target seconds
+        A Governor (constructed with the keyword arguments) then chooses
+        the resolution, overriding the one asked for, and for stream()
+        how many frames to skip.  Its decision for each frame is in the
+        stats, under "governor".  A target of None turns this off."""
+        if target is None:
+            self.governor = None
+        else:
+            self.governor = Governor( target, **kw )
+
+    def see(self, mode, res, stats, roi = None, coarse_res = None):
+        """Find the markers that can be seen
 
-            info = marker_luts[mode][int(m.code)]
-
-            vertices = []
-            for v in m.vertices:
-                vertices.append( Point( image = ImageCoord( x = v.image.x,
-                                                            y = v.image.y ),
-                                        world = WorldCoord( x = v.world.x,
-                                                            y = v.world.y,
-                                                            z = v.world.z ),
-                                        # libkoki does not yet provide these coords
-                                        polar = PolarCoord( 0,0,0 ) ) )
-
-            centre = Point( image = ImageCoord( x = m.centre.image.x,
-                                                y = m.centre.image.y ),
-                            world = WorldCoord( x = m.centre.world.x,
-                                                y = m.centre.world.y,
-                                                z = m.centre.world.z ),
-                            polar = PolarCoord( length = m.distance,
-                                                rot_x = m.bearing.x,
-                                                rot_y = m.bearing.y ) )
-
-            orientation = Orientation( rot_x = m.rotation.x,
-                                       rot_y = m.rotation.y,
-                                       rot_z = m.rotation.z )
-
-            marker = Marker( info = info,
-                             timestamp = acq_time,
-                             res = res,
-                             vertices = vertices,
-                             centre = centre,
-                             orientation = orientation )
-            srmarkers.append(marker)
-
-        self.koki.image_free(img)
+        roi restricts the search to a (left, top, right, bottom) region
+        of the frame, in pixels.  When coarse_res is given, markers are
+        first searched for in a copy of the frame downscaled to that
+        resolution (which must divide res), and then searched for again
+        at full resolution only in the regions around those found.
+
+        When governed, roi and coarse_res are scaled to the resolution
+        the governor chose."""
+        if self.governor is not None:
+            gov_res = self.governor.res
+            roi, coarse_res = _scale_search( res, gov_res, roi, coarse_res )
+            res = gov_res
+
+        markers, times = self._detect( self._capture_frame(res), mode,
+                                       roi = roi, coarse_res = coarse_res )
 
         if stats:
-            return (srmarkers, times)
+            return (markers, times)
+
+        return markers
+
+    def see_async(self, mode, res, stats = False, roi = None, coarse_res = None):
+        """Start looking for markers in the background
+        Returns a VisionFuture for the result of see().  If the worker is
+        still busy with an earlier request, any other request waiting for
+        it shares this one's result if it has the same arguments, and
+        otherwise fails with ResultSuperseded."""
+        if self._async is None:
+            self._async = AsyncWorker(self)
+            self._async.start()
+
+        return self._async.submit( mode = mode, res = res, stats = stats,
+                                   roi = roi, coarse_res = coarse_res )
+
+    def see_colour(self, mode, res, colours, stats = False, markers = False):
+        """Find blobs of the given colours
+
+        colours is a dict of colour.ColourRanges, indexed by name.
+        Returns a dict of lists of colour.Blobs, indexed by colour name.
+        If markers is True, markers are also looked for in the same
+        frame, and a (markers, blobs) tuple is returned."""
+        timer = Timer()
+
+        with self.lock:
+            self._set_res(res)
+
+            if markers:
+                frame = self._grab()
+                times = frame.times
+            else:
+                times = {}
+                self._sync_recorder()
+                with timer:
+                    self._frame = self._dequeue()
+                times["cam"] = timer.time
+
+            # The frame's buffer is only valid until the next capture,
+            # so take a copy to look for blobs in without the lock held
+            with timer:
+                data = string_at( self._frame, res[0] * res[1] * 2 )
+            copy_time = timer.time
+
+        with timer:
+            blobs = colour.find_blobs( data, res, colours )
+        times["colour"] = copy_time + timer.time
+
+        if markers:
+            # (frame.times, and so these times, include the colour timing)
+            srmarkers, times = self._detect( frame, mode )
+            result = (srmarkers, blobs)
+        else:
+            result = blobs
+            self.profile.add( times )
+
+        if stats:
+            return (result, times)
+
+        return result
+
+    def stream(self, mode, res, stats = False, depth = 2, workers = 2):
+        """Generator that continuously yields the markers that can be seen
+
+        Frames are captured and converted in one thread whilst up to
+        'workers' threads run marker detection on earlier frames.  At
+        most 'depth' frames wait for detection -- the oldest is dropped
+        to make space for a new one.  Results are yielded in capture order."""
+        pipeline = Pipeline( self, mode, res, depth, workers )
 
-        return srmarkers
+        try:
+            for markers, times in pipeline:
+                if stats:
+                    yield (markers, times)
+                else:
+                    yield markers
+        finally:
+            pipeline.stop()
@@ -45,7 +45,9 @@ class EnumWaiter(threading.Thread):
     def run(self):
         from sr.pysric import PySric
 
-        ps = PySric()
+        # Enumerate the bus afresh, and cache it for everything else
+        ps = PySric( use_cache = False )
+        ps.write_enum_cache()
         self.waiting.release()
 
 def test_bus():
@@ -0,0 +1,53 @@
+import unittest
+import sr.colour
+
+def yuyv_frame(res, square, yuv):
+    "A grey YUYV frame, with square = (left, top, size) filled with yuv"
+    w, h = res
+    left, top, size = square
+    f = bytearray( [ 80, 128, 80, 128 ] * ( w * h // 2 ) )
+
+    for y in range( top, top + size ):
+        for x in range( left // 2, ( left + size ) // 2 ):
+            o = ( y * w // 2 + x ) * 4
+            f[ o : o + 4 ] = bytearray( [ yuv[0], yuv[1], yuv[0], yuv[2] ] )
+
+    return f
+
+class ColourTest(unittest.TestCase):
+    "Tests of colour blob detection"
+
+    def test_find_blobs(self):
+        "Check that a square of colour is found as one blob"
+        frame = yuyv_frame( (64, 48), (16, 16, 16), (80, 100, 200) )
+        blobs = sr.colour.find_blobs( frame, (64, 48),
+                                      { "red": sr.colour.RED,
+                                        "blue": sr.colour.BLUE } )
+
+        self.assertEqual( blobs["blue"], [] )
+        self.assertEqual( len(blobs["red"]), 1 )
+
+        b = blobs["red"][0]
+        self.assertEqual( b.area, 16 * 16 )
+        self.assertEqual( b.centre, (23.5, 23.5) )
+        self.assertEqual( b.bounds, (16, 16, 32, 32) )
+
+    def test_min_area(self):
+        "Check that blobs smaller than min_area are dropped"
+        frame = yuyv_frame( (64, 48), (8, 8, 8), (80, 100, 200) )
+        blobs = sr.colour.find_blobs( frame, (64, 48), { "red": sr.colour.RED },
+                                      min_area = 100 )
+        self.assertEqual( blobs["red"], [] )
+
+    def test_cell_counts(self):
+        "Check the packed counting of a row of cells against counting each"
+        mw, block, bw = 12, 3, 4
+        mask = "".join( chr( ( x * 7 + y * 3 ) % 5 == 0 )
+                        for y in range(block) for x in range(mw) )
+
+        expected = [ sum( mask[ y * mw + x ] == "\x01"
+                          for y in range(block)
+                          for x in range( c * bw, ( c + 1 ) * bw ) )
+                     for c in range( mw // bw ) ]
+        self.assertEqual( list( sr.colour._cell_counts( mask, mw, 0, block, bw ) ),
+                          expected )
@@ -0,0 +1,55 @@
+import unittest
+import mmap, os, tempfile
+from ctypes import c_uint8, string_at
+import sr.recorder
+
+class RecorderTest(unittest.TestCase):
+    "Tests of the frame ring file"
+
+    def setUp(self):
+        fd, self.fname = tempfile.mkstemp( suffix = ".ring" )
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink( self.fname )
+
+    def test_round_trip(self):
+        "Check that the newest frames are read back oldest first"
+        res = (4, 2)
+        size = sr.recorder.frame_size( res )
+        rec = sr.recorder.FrameRecorder( self.fname, res, 3 )
+
+        for n in range(5):
+            frame = ( c_uint8 * size )( *( [n] * size ) )
+            rec.record( frame, 100.0 + n )
+        rec.flush()
+
+        self.assertTrue( sr.recorder.is_ring_file( self.fname ) )
+
+        with open( self.fname, "rb" ) as f:
+            ring = sr.recorder.RingFile( mmap.mmap( f.fileno(), 0,
+                                                    access = mmap.ACCESS_COPY ) )
+        ring.check()
+
+        self.assertEqual( ring.res, res )
+        self.assertEqual( ring.nframes, 3 )
+        self.assertEqual( [ ring.timestamp(n) for n in range(3) ],
+                          [ 102.0, 103.0, 104.0 ] )
+        self.assertEqual( [ string_at( ring.frame_address(n), size )
+                            for n in range(3) ],
+                          [ chr(n) * size for n in (2, 3, 4) ] )
+
+    def test_writer(self):
+        "Check that frames offered to a FrameWriter are recorded"
+        res = (4, 2)
+        size = sr.recorder.frame_size( res )
+        writer = sr.recorder.FrameWriter( sr.recorder.FrameRecorder( self.fname, res, 2 ) )
+        writer.start()
+
+        frame = ( c_uint8 * size )( *( [7] * size ) )
+        writer.offer( frame, 1.0 )
+        writer.sync()
+        writer.stop()
+
+        # The frame is either recorded, or dropped by sync()
+        self.assertEqual( writer.recorder.nframes + writer.dropped, 1 )
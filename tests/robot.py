@@ -1,6 +1,6 @@
 import unittest
 from unittest import TestLoader, TestSuite
-import jio, power, environ, vision
+import jio, power, environ, vision, recorder, sric, colour
 import sr
 
 FORCE_ALL_DEVS = False
@@ -9,12 +9,18 @@ jointio_tests = TestLoader().loadTestsFromTestCase(jio.JointIOTest)
 power_tests = TestLoader().loadTestsFromTestCase(power.PowerTest)
 environ_tests = TestLoader().loadTestsFromTestCase(environ.EnvironTest)
 vision_tests = TestLoader().loadTestsFromTestCase(vision.VisionTest)
+recorder_tests = TestLoader().loadTestsFromTestCase(recorder.RecorderTest)
+sric_tests = TestLoader().loadTestsFromTestCase(sric.SricTest)
+colour_tests = TestLoader().loadTestsFromTestCase(colour.ColourTest)
 
 R = sr.Robot()
 
 suite = TestSuite( [ environ_tests,
                      power_tests,
-                     vision_tests ] )
+                     vision_tests,
+                     recorder_tests,
+                     sric_tests,
+                     colour_tests ] )
 
 if len( R.io ) or FORCE_ALL_DEVS:
     suite.addTests( [ jointio_tests ] )
@@ -0,0 +1,148 @@
+import unittest
+import sr.pysric as pysric
+import sr.tssric as tssric
+
+class FakeLibsric(object):
+    """Stands in for libsric, echoing each frame back as its reply
+
+    The replies to the first 'late' frames sent only arrive after their
+    poll has timed out, as if the device were slow."""
+    def __init__(self, late = 0):
+        self.late = late
+        self.contexts = 0
+        # Replies waiting on each context, and those still on their way
+        self.replies = {}
+        self.delayed = {}
+        self.error = 0
+        # Note flags, indexed by (context, device)
+        self.note_flags = {}
+
+    def sric_init(self):
+        self.contexts += 1
+        ctx = self.contexts
+        self.replies[ctx] = []
+        self.delayed[ctx] = []
+        return ctx
+
+    def sric_quit(self, ctx):
+        del self.replies[ctx]
+        del self.delayed[ctx]
+
+    def sric_tx(self, ctx, frame):
+        reply = ( frame.address, frame.payload[:frame.payload_length] )
+
+        if self.late > 0:
+            self.late -= 1
+            self.delayed[ctx].append( reply )
+        else:
+            self.replies[ctx].append( reply )
+        return 0
+
+    def sric_poll_rx(self, ctx, frame, timeout):
+        if len( self.replies[ctx] ) == 0:
+            "Time out, with the delayed replies arriving just after"
+            self.replies[ctx] += self.delayed[ctx]
+            self.delayed[ctx] = []
+            self.error = pysric.sric_errors.index( pysric.SricErrorTimeout )
+            return 1
+
+        frame.address, payload = self.replies[ctx].pop(0)
+        frame.payload_length = len(payload)
+        frame.payload[:len(payload)] = payload
+        return 0
+
+    def sric_get_error(self, ctx):
+        return self.error
+
+    def sric_enumerate_devices(self, ctx, device):
+        return None
+
+    def sric_note_set_flags(self, ctx, device, flags):
+        self.note_flags[ (ctx, device) ] = flags
+        return 0
+
+    def sric_note_get_flags(self, ctx, device):
+        return self.note_flags.get( (ctx, device), 0 )
+
+class FakePySric(pysric.PySric):
+    "A PySric using a FakeLibsric"
+    def __init__(self, lib, policy = None):
+        self._lib = lib
+        pysric.PySric.__init__( self, policy = policy, use_cache = False )
+
+    def _load_lib(self):
+        self.libsric = self._lib
+        self.has_notes = True
+
+class FakeSricMan(object):
+    "Provides the same FakePySric to every thread"
+    def __init__(self, ps):
+        self.ps = ps
+
+    def get(self):
+        return self.ps
+
+class SricTest(unittest.TestCase):
+    "Tests of pysric and tssric, using a fake libsric"
+
+    def test_default_timeout(self):
+        "Check that replies are waited for forever by default"
+        self.assertEqual( pysric.RetryPolicy().timeout, -1 )
+
+    def test_stale_reply(self):
+        "Check that a late reply isn't returned to the next transaction"
+        lib = FakeLibsric( late = 1 )
+        ps = FakePySric( lib, pysric.RetryPolicy( timeout = 10 ) )
+
+        self.assertRaises( pysric.SricErrorTimeout, ps.txrx, 1, [1] )
+        self.assertEqual( ps.txrx( 1, [2] ), [2] )
+        self.assertEqual( lib.contexts, 2 )
+
+        st = ps.stats[1]
+        self.assertEqual( st.transactions, 2 )
+        self.assertEqual( st.timeouts, 1 )
+
+    def test_retry(self):
+        "Check that a frame whose reply is late is sent again"
+        lib = FakeLibsric( late = 2 )
+        ps = FakePySric( lib, pysric.RetryPolicy( timeout = 10, retries = 2,
+                                                  backoff = 0 ) )
+
+        self.assertEqual( ps.txrx( 1, [3] ), [3] )
+        self.assertEqual( ps.txrx( 1, [4] ), [4] )
+
+        summary = ps.stats.summary()[1]
+        self.assertEqual( summary["transactions"], 2 )
+        self.assertEqual( summary["retries"], 2 )
+        self.assertEqual( summary["timeouts"], 0 )
+
+    def test_txrx_many_timeout(self):
+        "Check that a timeout in txrx_many leaves no replies behind"
+        lib = FakeLibsric( late = 1 )
+        ps = FakePySric( lib, pysric.RetryPolicy( timeout = 10 ) )
+
+        self.assertRaises( pysric.SricErrorTimeout, ps.txrx_many,
+                           [ (1, [5]), (2, [6]) ] )
+        self.assertEqual( ps.txrx_many( [ (1, [7]), (2, [8]) ] ), [ [7], [8] ] )
+
+    def test_enum_cache_unwritable(self):
+        "Check that failing to write the enumeration cache isn't fatal"
+        pysric.save_enum_cache( [ (1, 2) ], "/nonexistent/sric-enum.json" )
+
+    def test_note_flags(self):
+        "Check that subscriptions set the devices' note flags"
+        lib = FakeLibsric()
+        ps = FakePySric( lib )
+        listener = tssric.NoteListener( FakeSricMan( ps ) )
+        cb = lambda address, note, payload: None
+
+        listener.subscribe( 1, 2, cb )
+        listener.subscribe( 1, 5, cb )
+        listener._update_registrations( ps )
+        self.assertEqual( ps.note_get_flags( 1 ), (1 << 2) | (1 << 5) )
+
+        listener.unsubscribe( 1, 2, cb )
+        listener._update_registrations( ps )
+        self.assertEqual( ps.note_get_flags( 1 ), 1 << 5 )
+
+        self.assertRaises( ValueError, listener.subscribe, 1, 64, cb )
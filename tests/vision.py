@@ -1,5 +1,6 @@
 import unittest
-import sr, sr.vision
+import threading
+import sr, sr.vision, sr.calibration
 
 class VisionTest(unittest.TestCase):
     "Tests of the vision API"
@@ -23,3 +24,158 @@ class VisionTest(unittest.TestCase):
 
             self.assertTrue( isinstance( markers, list ) )
 
+
+    def test_zero_copy(self):
+        "Check that zero-copy mode reuses its images"
+        self.R.vision.zero_copy = True
+        self.R.see()
+        markers, times = self.R.see( stats = True )
+
+        self.assertTrue( isinstance( markers, list ) )
+        self.assertEqual( times["allocs"], 0 )
+
+    def test_stream(self):
+        "Check that we can stream markers"
+        n = 0
+        for markers in self.R.stream():
+            self.assertTrue( isinstance( markers, list ) )
+            n += 1
+
+            if n == 5:
+                break
+
+    def test_tracker(self):
+        "Check that the tracker predicts a moving marker's position"
+        V = sr.vision
+        info = V.marker_luts["dev"][0]
+        tracker = V.Tracker()
+
+        for n in range(10):
+            t = n * 0.1
+            centre = V.Point( image = V.ImageCoord( 0, 0 ),
+                              world = V.WorldCoord( t, 0, 1 ),
+                              polar = V.PolarCoord( 1, 0, 0 ) )
+            tracker.update( [ V.Marker( info = info,
+                                        timestamp = t,
+                                        res = (800,600),
+                                        vertices = [],
+                                        centre = centre,
+                                        orientation = V.Orientation( 0, 0, 0 ) ) ] )
+
+        track = tracker.predict( info.code, 1.0 )
+        self.assertTrue( abs( track.position.x - 1.0 ) < 0.05 )
+        self.assertTrue( tracker.predict( info.code, 10.0 ) is None )
+
+    def test_calibration_interpolate(self):
+        "Check that uncalibrated resolutions' focal lengths are interpolated"
+        cal = sr.calibration.CameraCalibration( { (640,480): (640.0, 600.0),
+                                                  (1280,960): (1600.0, 1440.0),
+                                                  (1280,720): (1.0, 1.0) } )
+
+        # Half way in width, with the same aspect ratio
+        fx, fy = cal[(960,720)]
+        self.assertAlmostEqual( fx, 960 * 1.125 )
+        self.assertAlmostEqual( fy, 960 * 1.03125 )
+
+        # Outside the calibrated widths, the nearest ratio is used
+        self.assertAlmostEqual( cal[(320,240)][0], 320.0 )
+        self.assertEqual( cal[(640,480)], (640.0, 600.0) )
+
+    def test_see_async(self):
+        "Check that asynchronous see() returns markers via a future"
+        called = threading.Event()
+        future = self.R.see_async( callback = lambda f: called.set() )
+
+        self.assertTrue( isinstance( future.result( 10 ), list ) )
+        called.wait( 1 )
+        self.assertTrue( called.is_set() )
+
+    def test_see_async_callback_error(self):
+        "Check that a callback raising doesn't stop the vision worker"
+        def callback(f):
+            raise ValueError( "Callback failure" )
+
+        self.R.see_async( callback = callback ).result( 10 )
+        self.assertTrue( isinstance( self.R.see_async().result( 10 ), list ) )
+
+    def test_see_all(self):
+        "Check that all the cameras' markers are tagged with their camera"
+        markers = self.R.see_all()
+
+        self.assertTrue( isinstance( markers, list ) )
+        for m in markers:
+            self.assertTrue( m.camera in self.R.cameras )
+
+    def test_controls(self):
+        "Check that we can see with the fast camera preset"
+        controls = self.R.vision.controls
+        self.assertTrue( isinstance( controls.names(), list ) )
+
+        controls.apply_preset( "fast" )
+        self.assertTrue( isinstance( self.R.see(), list ) )
+        controls.apply_preset( "auto" )
+
+        # What "fast" set, and "auto" doesn't name, is back to the default
+        if "gain" in controls.names():
+            self.assertEqual( controls["gain"], controls.query("gain").default )
+
+    def test_govern(self):
+        "Check that the governor reports its decisions in the stats"
+        self.R.vision.govern( 0.1 )
+
+        try:
+            markers, times = self.R.see( stats = True )
+            self.assertTrue( times["governor"]["res"] in sr.vision.GOVERNOR_RESOLUTIONS )
+        finally:
+            self.R.vision.govern( None )
+
+    def test_governor_skip(self):
+        "Check that the governor only skips frames where skipping is applied"
+        gov = sr.vision.Governor( 0.1, settle = 1 )
+
+        while gov.res != gov.resolutions[-1]:
+            gov.update( gov.res, 1.0 )
+
+        self.assertEqual( gov.update( gov.res, 1.0 )["decision"], "saturated" )
+        self.assertEqual( gov.skip, 0 )
+
+        self.assertEqual( gov.update( gov.res, 1.0, skippable = True )["decision"], "skip_up" )
+        self.assertEqual( gov.skip, 1 )
+
+    def test_govern_coarse(self):
+        "Check that coarse_res and roi are scaled to the governed resolution"
+        roi, coarse_res = sr.vision._scale_search( (800,600), (320,240),
+                                                   (100, 100, 400, 300), (400,300) )
+        self.assertEqual( roi, (40, 40, 160, 120) )
+        self.assertEqual( coarse_res, (160,120) )
+
+        # Scaled by 0.8, which doesn't land on whole pixels
+        roi, coarse_res = sr.vision._scale_search( (800,600), (640,480),
+                                                   (51, 51, 251, 251), (400,300) )
+        self.assertEqual( roi, (40, 40, 201, 201) )
+        self.assertEqual( coarse_res, (320,240) )
+        for v in roi:
+            self.assertTrue( isinstance( v, int ) )
+
+        # The coarse and roi search runs with the scaled values
+        markers = self.R.see( res = (640,480), roi = roi, coarse_res = coarse_res )
+        self.assertTrue( isinstance( markers, list ) )
+
+        self.R.vision.govern( 0.1, resolutions = [ (320,240) ] )
+
+        try:
+            markers = self.R.see( res = (800,600), coarse_res = (400,300),
+                                  roi = (51, 51, 251, 251) )
+            self.assertTrue( isinstance( markers, list ) )
+        finally:
+            self.R.vision.govern( None )
+
+    def test_quantize_boxes(self):
+        "Check that search regions don't overlap once grown for the pool"
+        boxes = sr.vision._quantize_boxes( [ (10, 10, 40, 40), (60, 10, 90, 40) ],
+                                           (800,600) )
+        self.assertEqual( boxes, [ (10, 10, 138, 74) ] )
+
+        boxes = sr.vision._quantize_boxes( [ (10, 10, 40, 40), (200, 10, 230, 40) ],
+                                           (800,600) )
+        self.assertEqual( len(boxes), 2 )